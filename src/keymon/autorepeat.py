@@ -0,0 +1,135 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Recognize key autorepeat in the captured events and drop or count it.
+
+A held key repeats in one of three ways, depending on the backend:
+  - evdev sends presses with value 2,
+  - X with detectable autorepeat sends presses of a key that is down,
+  - plain X sends a fake release and a press, both stamped with the same
+    server time.
+The last one is only told apart from a real release by the press after it,
+so sources that know the time of their backend's clock hand it to filter()
+with each event. Their releases are held for that press, for at most
+HOLD_SECONDS of wall time, after which flush() passes them on. Events
+without a backend time are never taken for fake releases.
+
+Sources run their events through the filter before queueing them, see
+sources.EventSource.autorepeat, so repeats never reach KeyMon's queue.
+"""
+
+from events import XEvent
+
+MODES = ('keep', 'drop', 'collapse')
+# Most milliseconds by the backend clock between a fake release and its
+# repeat press. X gives both the same server time.
+REPEAT_GAP = 1
+# Most seconds a release is held back waiting for its repeat press.
+HOLD_SECONDS = 0.01
+
+
+class AutoRepeatFilter(object):
+  """Filters repeats out of a stream of XEvents.
+
+  In drop mode repeats disappear, so a held key is one press and one
+  release. Collapse mode also logs an EV_REP event before the release, its
+  value the number of repeats dropped.
+  """
+
+  def __init__(self, mode='drop', gap=REPEAT_GAP, hold=HOLD_SECONDS):
+    if mode not in MODES:
+      raise ValueError('Unknown autorepeat mode: %s' % mode)
+    self.mode = mode
+    self.gap = gap
+    self.hold = hold
+    self.repeats = 0  # repeats seen, for the curious
+    self._down = set()
+    self._held = []  # (release, backend time) that may be fake
+    self._counts = {}  # key id -> (repeats, time of the last one)
+
+  def filter(self, event, backend_time=None):
+    """Take an event.
+    Args:
+      event: the XEvent.
+      backend_time: time of the event by the backend's clock, e.g. the X
+          server time in milliseconds, or None if there is none.
+    Returns:
+      list of the events to pass on, in order.
+    """
+    if self.mode == 'keep' or event.type != 'EV_KEY':
+      if self._held:
+        return self._release_held() + [event]
+      return [event]
+    code = event.code
+    if event.value == 1 and self._held and backend_time is not None:
+      for held in self._held:
+        if held[0].code == code and 0 <= backend_time - held[1] <= self.gap:
+          self._held.remove(held)
+          return self._repeat(code, event.time)
+    out = self._release_held() if self._held else []
+    if event.value == 2 or (event.value == 1 and code in self._down):
+      return out + self._repeat(code, event.time)
+    if event.value == 1:
+      self._down.add(code)
+      out.append(event)
+    elif (event.value == 0 and code in self._down and
+          backend_time is not None):
+      self._held.append((event, backend_time))
+    elif event.value == 0:
+      out.extend(self._release([event]))
+    else:
+      out.append(event)
+    return out
+
+  def held(self):
+    """Are releases held back waiting for their repeat press?"""
+    return bool(self._held)
+
+  def flush(self, now=None):
+    """Pass on the held releases captured hold seconds before now, or all.
+    Returns:
+      list of the events to pass on.
+    """
+    if not self._held:
+      return []
+    if now is None:
+      return self._release_held()
+    due = 0
+    while (due < len(self._held) and
+           self._held[due][0].time <= now - self.hold):
+      due += 1
+    due, self._held = self._held[:due], self._held[due:]
+    return self._release([release for release, unused_time in due])
+
+  def _repeat(self, code, stamp):
+    self.repeats += 1
+    if self.mode == 'collapse':
+      count = self._counts.get(code, (0, None))[0]
+      self._counts[code] = (count + 1, stamp)
+    return []
+
+  def _release_held(self):
+    held, self._held = self._held, []
+    return self._release([release for release, unused_time in held])
+
+  def _release(self, releases):
+    out = []
+    for event in releases:
+      self._down.discard(event.code)
+      if event.code in self._counts:
+        count, stamp = self._counts.pop(event.code)
+        out.append(XEvent('EV_REP', event.scancode, event.code, count,
+                          event.window, stamp))
+      out.append(event)
+    return out
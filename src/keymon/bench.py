@@ -0,0 +1,304 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro benchmarks for the capture path.
+
+Run it directly:
+  python bench.py [events]
+  python bench.py startup    # exits with 1 if a pianist command got slow
+  python bench.py handoff    # capture to handling delay of --capture modes
+"""
+
+import collections
+import os
+import select
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import evdev
+import events
+import recording
+import sources
+
+# KeyMon.IDLE_BATCH, key_mon imports gtk.
+IDLE_BATCH = 1000
+
+
+class _LegacyXEvent(object):
+  """The XEvent from before it had slots, kept to compare against."""
+  def __init__(self, atype, scancode, code, value):
+    self._type = atype
+    self._scancode = scancode
+    self._code = code
+    self._value = value
+
+  def get_type(self):
+    return self._type
+  type = property(get_type)
+
+  def get_scancode(self):
+    return self._scancode
+  scancode = property(get_scancode)
+
+  def get_code(self):
+    return self._code
+  code = property(get_code)
+
+  def get_value(self):
+    return self._value
+  value = property(get_value)
+
+
+def event_size(event):
+  """Bytes held by one event, without the shared type and code values."""
+  size = sys.getsizeof(event)
+  if hasattr(event, '__dict__'):
+    size += sys.getsizeof(event.__dict__)
+  if isinstance(event.value, tuple):
+    size += sys.getsizeof(event.value)
+  return size
+
+
+def bench_events(event_class, count):
+  """Create and consume count events, half keys and half motion.
+  Returns:
+    (events per second, mean bytes per event)
+  """
+  queue = []
+  start = time.time()
+  for i in xrange(count // 2):
+    queue.append(event_class('EV_KEY', 30, 5, i & 1))
+    queue.append(event_class('EV_MOV', 0, 0, (i & 1023, i & 511)))
+  total = 0
+  for event in queue:
+    if event.type == 'EV_KEY':
+      total += event.code + event.value
+    else:
+      total += event.value[0]
+  elapsed = time.time() - start
+  size = sum(event_size(event) for event in queue[:2]) / 2.0
+  return len(queue) / elapsed, size
+
+
+def _synthetic(count):
+  return sources.SyntheticSource(key_rate=50000, motion_rate=50000,
+                                 count=count, seed=1, time_scale=0)
+
+
+def bench_source(count):
+  """Take count events from a SyntheticSource.
+  Returns:
+    events per second
+  """
+  devices = _synthetic(count)
+  devices.start()
+  start = time.time()
+  event = devices.next_event()
+  while event:
+    event = devices.next_event()
+  return count / (time.time() - start)
+
+
+def bench_pipeline(count):
+  """Push count synthetic events through the log writer, as KeyMon does:
+  KeyMon._log_event writes each line, KeyMon._handle_batch flushes once per
+  IDLE_BATCH events.
+  Returns:
+    events per second
+  """
+  devices = _synthetic(count)
+  fd, path = tempfile.mkstemp(prefix='pianist-bench-')
+  event_log = os.fdopen(fd, 'w')
+  try:
+    devices.start()
+    start = time.time()
+    more = True
+    while more:
+      handled = 0
+      while handled < IDLE_BATCH:
+        event = devices.next_event()
+        if not event:
+          more = False
+          break
+        timestamp = event.time
+        if timestamp is None:
+          timestamp = time.time()
+        event_log.write(recording.format_event(timestamp, event))
+        handled += 1
+      if handled:
+        event_log.flush()
+    return count / (time.time() - start)
+  finally:
+    event_log.close()
+    os.unlink(path)
+
+
+def _produce(emit, count, rate):
+  """Call emit(i) for i in range(count), at rate per second."""
+  start = time.time()
+  for i in xrange(count):
+    delay = start + float(i) / rate - time.time()
+    if delay > 0:
+      time.sleep(delay)
+    emit(i)
+
+
+def _handoff_thread(count, rate):
+  queue = collections.deque()
+  producer = threading.Thread(target=_produce, args=(
+      lambda i: queue.append(events.XEvent('EV_KEY', 30, 5, i & 1,
+                                           time=time.time())),
+      count, rate))
+  producer.start()
+  latencies = []
+  while len(latencies) < count:
+    batch = 0
+    while queue and batch < IDLE_BATCH:
+      event = queue.popleft()
+      latencies.append(time.time() - event.time)
+      batch += 1
+    if batch < IDLE_BATCH:
+      time.sleep(0.001)  # as KeyMon.on_idle does once the queue is empty
+  producer.join()
+  return latencies
+
+
+def _handoff_select(count, rate):
+  read_fd, write_fd = os.pipe()
+  source = evdev.EvdevSource(['/dev/fd/%d' % read_fd])
+  source.start()
+  os.close(read_fd)
+  producer = threading.Thread(target=_produce, args=(
+      lambda i: os.write(write_fd, evdev.pack_event(time.time(), evdev.EV_KEY,
+                                                    30, i & 1)),
+      count, rate))
+  producer.start()
+  latencies = []
+  try:
+    while len(latencies) < count:
+      select.select([source.fileno()], [], [], 1.0)
+      source.read_ready()
+      event = source.next_event()
+      while event:
+        latencies.append(time.time() - event.time)
+        event = source.next_event()
+  finally:
+    producer.join()
+    os.close(write_fd)
+    source.stop_listening()
+  return latencies
+
+
+def bench_handoff(engine, count=2000, rate=1000):
+  """Delay from the capture of an event to KeyMon handling it.
+
+  Stands in for the two --capture main loops without gtk or X: thread
+  queues XEvents from another thread and polls the queue like
+  KeyMon.on_idle, select reads input_events from a pipe when select() finds
+  it readable, like KeyMon.on_readable. latency.py measures the real
+  engines under Xvfb.
+  Returns:
+    sorted latencies in seconds
+  """
+  if engine == 'thread':
+    return sorted(_handoff_thread(count, rate))
+  return sorted(_handoff_select(count, rate))
+
+
+def check_handoff(count=2000, rates=(100, 1000, 10000)):
+  """Print the handoff delays of both --capture modes at a few rates."""
+  print '%-8s %8s %9s %9s %9s' % ('capture', 'rate', 'p50 ms', 'p99 ms',
+                                  'max ms')
+  for engine in ('thread', 'select'):
+    for rate in rates:
+      latencies = bench_handoff(engine, count, rate)
+      print '%-8s %8d %9.3f %9.3f %9.3f' % (
+          engine, rate, latencies[len(latencies) // 2] * 1000,
+          latencies[int(len(latencies) * 0.99)] * 1000, latencies[-1] * 1000)
+
+
+# Modules only the capture commands may import.
+CAPTURE_MODULES = ('gtk', 'gobject', 'pygtk', 'Xlib')
+# Most seconds the analysis commands may take to import.
+STARTUP_BUDGET = 0.5
+
+_STARTUP_SCRIPT = """
+import sys, time
+start = time.time()
+sys.path.insert(0, %r)
+from keymon import cli
+cli.load_command(%r)
+print time.time() - start
+print ' '.join(name for name in sys.modules
+               if name.split('.')[0] in %r and sys.modules[name])
+"""
+
+
+def bench_startup(command):
+  """Import a pianist command in a fresh interpreter.
+  Returns:
+    (seconds, capture modules it imported)
+  """
+  src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  out = subprocess.check_output(
+      [sys.executable, '-c',
+       _STARTUP_SCRIPT % (src, command, CAPTURE_MODULES)])
+  seconds, modules = (out.splitlines() + [''])[:2]
+  return float(seconds), modules.split()
+
+
+def check_startup():
+  """Guard against analysis commands importing the capture stack.
+  Returns:
+    True if every command is within STARTUP_BUDGET and imports nothing of
+    CAPTURE_MODULES.
+  """
+  import cli
+  ok = True
+  print '%-10s %10s  %s' % ('command', 'import ms', 'capture modules')
+  for command in cli.COMMANDS:
+    if command in ('record', 'replay'):
+      continue
+    seconds, modules = bench_startup(command)
+    print '%-10s %10.1f  %s' % (command, seconds * 1000,
+                                ' '.join(modules) or '-')
+    if modules or seconds > STARTUP_BUDGET:
+      ok = False
+  return ok
+
+
+def main(argv):
+  if argv[1:] == ['startup']:
+    sys.exit(int(not check_startup()))
+  if argv[1:] == ['handoff']:
+    check_handoff()
+    return
+  count = 1000000
+  if len(argv) > 1:
+    count = int(argv[1])
+  print '%-10s %14s %14s' % ('XEvent', 'events/s', 'bytes/event')
+  for name, event_class in (('legacy', _LegacyXEvent),
+                            ('slots', events.XEvent)):
+    rate, size = bench_events(event_class, count)
+    print '%-10s %14.0f %14.1f' % (name, rate, size)
+  print 'synthetic source: %.0f events/s' % bench_source(count)
+  print 'synthetic source -> log writer: %.0f events/s' % (
+      bench_pipeline(count))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The pianist command: one entry point for the capture and analysis tools.
+
+  pianist record [key_mon options...]
+  pianist replay recording [key_mon options...]
+  pianist convert --to=npy|mov|mid recording...
+  pianist stats recording...
+  pianist index add|query recording...
+  pianist bench [events|startup]
+
+Each command imports its modules only when it runs, so the analysis
+commands never load gtk or Xlib. bench.py startup checks that they don't.
+"""
+
+import collections
+import optparse
+import sys
+
+# Command -> (modules it imports, description).
+COMMANDS = collections.OrderedDict([
+    ('record', (('key_mon',), 'Capture keys and mouse into a log.')),
+    ('replay', (('key_mon',), 'Play a recording back through KeyMon.')),
+    ('convert', (('event_array', 'motion_codec', 'midi'),
+                 'Convert text recordings to .npy, .mov or .mid files.')),
+    ('stats', (('sessions',), 'Summarize recordings per session.')),
+    ('index', (('profiles',), 'Add recordings to or query the typing '
+                              'profile index.')),
+    ('bench', (('bench',), 'Run the capture benchmarks or the startup '
+                           'check.')),
+])
+
+
+def load_command(name):
+  """Import the modules of a command.
+  Returns:
+    list of the modules.
+  """
+  package = __name__.rpartition('.')[0]
+  modules = []
+  for module in COMMANDS[name][0]:
+    __import__(module, globals(), {}, [], -1)
+    modules.append(sys.modules.get('%s.%s' % (package, module)) or
+                   sys.modules[module])
+  return modules
+
+
+def record(args):
+  key_mon, = load_command('record')
+  sys.argv = ['pianist record'] + args
+  key_mon.main()
+
+
+def replay(args):
+  if not args:
+    sys.exit('Usage: pianist replay recording [key_mon options...]')
+  key_mon, = load_command('replay')
+  sys.argv = ['pianist replay', '--replay', args[0]] + args[1:]
+  key_mon.main()
+
+
+def convert(args):
+  event_array, motion_codec, midi = load_command('convert')
+  parser = optparse.OptionParser(
+      'Usage: pianist convert --to=npy|mov|mid recording...')
+  parser.add_option('--to', default='npy',
+                    help='npy: binary event array, mov: delta encoded '
+                         'motion, mid: MIDI notes.')
+  parser.add_option('--kbd', default='us.kbd',
+                    help='Layout of the MIDI key notes.')
+  opts, fnames = parser.parse_args(args)
+  if opts.to == 'mid':
+    for out, played in midi.convert_corpus(fnames, opts.kbd):
+      print '%s: %d notes' % (out, played)
+    return
+  for fname in fnames:
+    out = '%s.%s' % (fname, opts.to)
+    if opts.to == 'npy':
+      out = event_array.save(out, event_array.load(fname))
+    elif opts.to == 'mov':
+      fin, fout = open(fname), open(out, 'wb')
+      try:
+        motion_codec.encode_text(fin, fout)
+      finally:
+        fin.close()
+        fout.close()
+    else:
+      parser.error('unknown format: %s' % opts.to)
+    print '%s: %s' % (fname, out)
+
+
+def stats(args):
+  sessions, = load_command('stats')
+  sessions.main(['pianist stats'] + args)
+
+
+def index(args):
+  profiles, = load_command('index')
+  profiles.main(['pianist index'] + args)
+
+
+def bench(args):
+  bench_module, = load_command('bench')
+  bench_module.main(['pianist bench'] + args)
+
+
+def usage():
+  lines = ['Usage: pianist command [args...]', '', 'Commands:']
+  for name, (unused_modules, description) in COMMANDS.items():
+    lines.append('  %-10s %s' % (name, description))
+  lines.append('')
+  lines.append('pianist command --help describes the options of a command.')
+  return '\n'.join(lines)
+
+
+def main(argv=None):
+  if argv is None:
+    argv = sys.argv
+  if len(argv) < 2 or argv[1] not in COMMANDS:
+    print usage()
+    return int(len(argv) > 1 and argv[1] not in ('help', '-h', '--help'))
+  globals()[argv[1]](argv[2:])
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
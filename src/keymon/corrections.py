@@ -0,0 +1,185 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Typing accuracy: how often and how much users correct with Backspace.
+
+A correction is a run of consecutive Backspace presses, its length is the
+number of keys it erased. The digraph typed right before a correction is
+taken as the likely error, and digraphs are ranked by how often they are
+followed by one. The typing keys are those a kbd layout has at the
+layout_eval.GEOMETRY positions: the digit row, the letters and the
+punctuation around them, and Space. Return, Tab, the keypad and the ISO key
+next to left Shift don't count.
+
+  python corrections.py [--kbd=us.kbd] [--processes=N] recording...
+
+reports per user, taken from the README next to the recordings.
+"""
+
+import collections
+import functools
+import optparse
+import os
+import sys
+
+import numpy as np
+
+import event_array
+import layout_eval
+import recording
+import sessions
+
+CORRECTION_KEY = 'KEY_BACKSPACE'
+# Occurrences a digraph needs before its correction rate is reported.
+MIN_DIGRAPHS = 5
+# Names of typing keys in the kbd files -> the name xmodmap gives them, which
+# recordings made with the X keymap have.
+_X_NAMES = {'KEY_QUOTERIGHT': 'KEY_APOSTROPHE', 'KEY_QUOTELEFT': 'KEY_GRAVE'}
+
+
+class Corrections(object):
+  """Mergeable correction counts, keys by name."""
+
+  def __init__(self):
+    self.typed = 0  # presses of typing keys
+    self.corrections = 0  # Backspace presses
+    self.bursts = collections.Counter()  # burst length -> count
+    self.digraphs = collections.Counter()  # (name, name) -> occurrences
+    self.before = collections.Counter()  # (name, name) -> bursts after it
+
+  def merge(self, other):
+    self.typed += other.typed
+    self.corrections += other.corrections
+    self.bursts.update(other.bursts)
+    self.digraphs.update(other.digraphs)
+    self.before.update(other.before)
+    return self
+
+  def error_prone(self, top=10, min_count=MIN_DIGRAPHS):
+    """The digraphs most often followed by a correction.
+    Returns:
+      list of ((name, name), rate, occurrences)
+    """
+    rates = [(digraph, float(self.before[digraph]) / count, count)
+             for digraph, count in self.digraphs.items()
+             if count >= min_count and self.before[digraph]]
+    rates.sort(key=lambda rate: (-rate[1], -rate[2]))
+    return rates[:top]
+
+  def report(self, top=10):
+    lines = []
+    bursts = sum(self.bursts.values())
+    lines.append('typed: %d, backspaces: %d (%.1f%%)' % (
+        self.typed, self.corrections,
+        100.0 * self.corrections / max(self.typed, 1)))
+    if bursts:
+      lines.append('corrections: %d, mean length %.2f, longest %d' % (
+          bursts, float(self.corrections) / bursts, max(self.bursts)))
+      lines.append('  length: ' + ', '.join(
+          '%d: %d' % (length, count)
+          for length, count in sorted(self.bursts.items())[:top]))
+    for (first, second), rate, count in self.error_prone(top):
+      lines.append('  %-28s %5.1f%% of %d' % (
+          '%s %s' % (first.replace('KEY_', ''), second.replace('KEY_', '')),
+          100 * rate, count))
+    return '\n'.join(lines)
+
+
+def compute(arr, names, kbd_file='us.kbd'):
+  """Find the corrections of an event_array.
+  Args:
+    arr: the events.
+    names: key_ids.key_names() of the process that built arr.
+    kbd_file: layout whose keys are the typing keys.
+  """
+  ret = Corrections()
+  typing = np.zeros(len(names) + 1, dtype=bool)
+  layout = set(layout_eval.layout_codes(kbd_file))
+  layout.update(_X_NAMES.get(name, name) for name in list(layout))
+  for code, name in enumerate(names):
+    typing[code] = name in layout
+  correction = names.index(CORRECTION_KEY) if CORRECTION_KEY in names else -1
+
+  keys = arr[arr['type'] == event_array.EV_KEY]
+  codes = keys['code'][keys['value'] == 1]
+  is_correction = codes == correction
+  codes = codes[typing[codes] | is_correction]
+  is_correction = codes == correction
+  ret.typed = int((~is_correction).sum())
+  ret.corrections = int(is_correction.sum())
+
+  # Bursts are the runs of True in is_correction.
+  edges = np.diff(np.concatenate(([0], is_correction.astype(np.int8), [0])))
+  starts = np.flatnonzero(edges == 1)
+  ends = np.flatnonzero(edges == -1)
+  for length, count in zip(*np.unique(ends - starts, return_counts=True)):
+    ret.bursts[int(length)] = int(count)
+
+  # Digraphs of typing keys, and those right before a burst.
+  size = len(names)
+  pairs = codes[:-1] * size + codes[1:]
+  typed_pairs = pairs[~is_correction[:-1] & ~is_correction[1:]]
+  starts = starts[starts >= 2]
+  before = pairs[starts - 2]
+  before = before[~is_correction[starts - 2] & ~is_correction[starts - 1]]
+  for counter, found in ((ret.digraphs, typed_pairs), (ret.before, before)):
+    for pair, count in zip(*np.unique(found, return_counts=True)):
+      counter[names[pair // size], names[pair % size]] = int(count)
+  return ret
+
+
+def user_of(fname, notes):
+  """The user of a recording, from the README next to it, or '?'.
+  Args:
+    notes: dict README path -> recording.read_notes() of it, filled in as
+        READMEs are read.
+  """
+  readme = os.path.join(os.path.dirname(fname), 'README.md')
+  if readme not in notes:
+    notes[readme] = {}
+    if os.path.exists(readme):
+      notes[readme] = recording.read_notes(readme)
+  return notes[readme].get(os.path.basename(fname), {}).get('user', '?')
+
+
+def by_user(fnames, kbd_file='us.kbd', processes=None):
+  """Analyze recordings in parallel and merge the results per user.
+  Returns:
+    dict user -> Corrections
+  """
+  arrays = [event_array.load(fname) for fname in fnames]
+  results = sessions.analyze(
+      arrays, functools.partial(compute, kbd_file=kbd_file), processes)
+  users = collections.defaultdict(Corrections)
+  notes = {}
+  for fname, result in zip(fnames, results):
+    users[user_of(fname, notes)].merge(result)
+  return users
+
+
+def main(argv):
+  parser = optparse.OptionParser('Usage: %prog [Options...] recording...')
+  parser.add_option('--kbd', default='us.kbd',
+                    help='Layout whose keys count as typing.')
+  parser.add_option('--processes', type='int', default=None,
+                    help='Worker processes, default one per core.')
+  opts, fnames = parser.parse_args(argv[1:])
+  for user, result in sorted(by_user(fnames, opts.kbd,
+                                     opts.processes).items()):
+    print '%s:' % user
+    print result.report()
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,289 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read key and mouse events straight from Linux evdev devices.
+
+Reads struct input_event records from /dev/input/event* (or any file or
+pipe holding them) without blocking, decodes whole reads at once and turns
+them into the same XEvents as the X RECORD backend, stamped with the kernel
+time. Evdev key codes are the scancodes of the kbd files, so keys get their
+names from a kbd layout rather than from an X keymap.
+
+  python evdev.py [--kbd=us.kbd] /dev/input/event3...
+"""
+
+import errno
+import itertools
+import optparse
+import os
+import select
+import struct
+import sys
+import time
+
+import key_ids
+import mod_mapper
+import sources
+from events import XEvent
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# struct input_event: struct timeval time; __u16 type, code; __s32 value.
+INPUT_EVENT = struct.Struct('llHHi')
+EVENT_SIZE = INPUT_EVENT.size
+READ_EVENTS = 256  # input_events read per read()
+
+# linux/input-event-codes.h
+EV_SYN, EV_KEY, EV_REL = 0, 1, 2
+SYN_REPORT = 0
+REL_X, REL_Y, REL_HWHEEL, REL_WHEEL = 0, 1, 6, 8
+_BUTTONS = {0x110: 'BTN_LEFT', 0x111: 'BTN_RIGHT', 0x112: 'BTN_MIDDLE',
+            0x113: 'BTN_SIDE', 0x114: 'BTN_EXTRA'}
+_KEY_CODES = 0x300
+
+if np is not None:
+  _DTYPE = np.dtype([('sec', 'i%d' % struct.calcsize('l')),
+                     ('usec', 'i%d' % struct.calcsize('l')),
+                     ('type', 'u2'), ('code', 'u2'), ('value', 'i4')])
+
+
+def pack_event(timestamp, atype, code, value):
+  """A struct input_event, e.g. to build streams to replay."""
+  sec = int(timestamp)
+  return INPUT_EVENT.pack(sec, int(round((timestamp - sec) * 1e6)), atype,
+                          code, value)
+
+
+def decode(data):
+  """Decode whole input_event records.
+  Returns:
+    list of (timestamp, type, code, value)
+  """
+  if np is not None:
+    rows = np.frombuffer(data, dtype=_DTYPE)
+    times = rows['sec'] + rows['usec'] / 1e6
+    return zip(times.tolist(), rows['type'].tolist(), rows['code'].tolist(),
+               rows['value'].tolist())
+  return [(sec + usec / 1e6, atype, code, value)
+          for sec, usec, atype, code, value in
+          (INPUT_EVENT.unpack_from(data, pos)
+           for pos in xrange(0, len(data), EVENT_SIZE))]
+
+
+class EvdevSource(sources.EventSource):
+  """Events of one or more evdev devices, files or pipes.
+
+  Relative pointer motion is summed into a position that starts at (0, 0)
+  and logged as EV_MOV once per SYN_REPORT. Key repeats keep the kernel
+  value 2. Files and pipes are finished at their end, devices never are.
+  What one read_ready() gets from several devices is merged by kernel
+  time, ties keep the order of paths.
+  """
+
+  def __init__(self, paths, kbd_file='us.kbd'):
+    self.paths = list(paths)
+    self.layout = mod_mapper.read_kdb(kbd_file)
+    dunno = key_ids.key_id('KEY_DUNNO')
+    self._key_ids = [dunno] * _KEY_CODES
+    for scancode in self.layout:
+      if scancode < _KEY_CODES:
+        self._key_ids[scancode] = self.layout.key_id(scancode)
+    for code, name in _BUTTONS.items():
+      self._key_ids[code] = key_ids.key_id(name)
+    self._wheel = key_ids.key_id('REL_WHEEL')
+    self._hwheel = key_ids.key_id('REL_HWHEEL')
+    self._fds = []
+    self._partial = {}  # fd -> bytes of an incomplete record
+    self._moved = {}  # fd -> motion since its last SYN_REPORT
+    self._poll = None
+    self.events = []
+    self._next = 0
+    self._x = self._y = 0
+
+  def start(self):
+    for path in self.paths:
+      fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+      self._fds.append(fd)
+      self._partial[fd] = ''
+      self._moved[fd] = False
+    if len(self._fds) > 1:
+      # One descriptor for the main loop to watch, readable when any is.
+      try:
+        self._poll = select.epoll()
+        for fd in self._fds:
+          self._poll.register(fd, select.EPOLLIN)
+      except (IOError, OSError):
+        # Regular files can't be polled, next_event() reads them anyway.
+        self._poll.close()
+        self._poll = None
+
+  def fileno(self):
+    if len(self._fds) == 1:
+      return self._fds[0]
+    if self._poll is not None:
+      return self._poll.fileno()
+    return None
+
+  def read_ready(self):
+    """Read and decode everything waiting on the devices."""
+    if self._next:
+      del self.events[:self._next]
+      self._next = 0
+    if not self._fds:
+      return
+    readable = select.select(self._fds, [], [], 0)[0]
+    batches = []
+    for fd in readable:
+      records = self._read(fd)
+      if records:
+        batches.append((fd, records))
+    if len(batches) == 1:
+      self._convert(*batches[0])
+    elif batches:
+      # Each batch is in time order already, a stable sort keeps the order
+      # of events with the same time, like those of one SYN_REPORT.
+      merged = [(fd, record) for fd, records in batches for record in records]
+      merged.sort(key=lambda item: item[1][0])
+      for fd, run in itertools.groupby(merged, key=lambda item: item[0]):
+        self._convert(fd, [record for unused_fd, record in run])
+
+  def _read(self, fd):
+    """Read what is waiting on fd.
+    Returns:
+      list of decoded records, see decode().
+    """
+    data = [self._partial[fd]]
+    while True:
+      try:
+        chunk = os.read(fd, READ_EVENTS * EVENT_SIZE)
+      except OSError as err:
+        if err.errno in (errno.EAGAIN, errno.EINTR):
+          break
+        raise
+      if not chunk:
+        self._close(fd)
+        break
+      data.append(chunk)
+    data = ''.join(data)
+    end = len(data) - len(data) % EVENT_SIZE
+    if fd in self._partial:
+      self._partial[fd] = data[end:]
+    if not end:
+      return []
+    return decode(data[:end])
+
+  def _convert(self, fd, records):
+    """Turn the decoded records of fd into queued XEvents."""
+    append = self.events.append
+    if self.autorepeat is not None:
+      append = self._append_filtered
+    key_id = self._key_ids
+    window = self.current_window()
+    moved = self._moved.get(fd, False)
+    for timestamp, atype, code, value in records:
+      if atype == EV_KEY:
+        if code in _BUTTONS:
+          append(XEvent('EV_KEY', 0, key_id[code], value, window,
+                        timestamp))
+        elif code < _KEY_CODES:
+          append(XEvent('EV_KEY', code, key_id[code], value, window,
+                        timestamp))
+      elif atype == EV_REL:
+        if code == REL_X:
+          self._x += value
+          moved = True
+        elif code == REL_Y:
+          self._y += value
+          moved = True
+        elif code == REL_WHEEL:
+          append(XEvent('EV_REL', 0, self._wheel, value, window,
+                        timestamp))
+        elif code == REL_HWHEEL:
+          append(XEvent('EV_REL', 0, self._hwheel, value, window,
+                        timestamp))
+      elif atype == EV_SYN and code == SYN_REPORT and moved:
+        append(XEvent('EV_MOV', 0, key_ids.NO_KEY, (self._x, self._y),
+                      window, timestamp))
+        moved = False
+    if fd in self._moved:
+      self._moved[fd] = moved
+
+  def _append_filtered(self, event):
+    self.events.extend(self.autorepeat.filter(event))
+
+  def _close(self, fd):
+    if self._poll is not None:
+      self._poll.unregister(fd)
+    os.close(fd)
+    self._fds.remove(fd)
+    del self._partial[fd]
+    del self._moved[fd]
+
+  def next_event(self):
+    """Returns the next event in queue, or None if none."""
+    if self._next == len(self.events):
+      self.read_ready()
+      if not self.events:
+        return None
+    event = self.events[self._next]
+    self._next += 1
+    return event
+
+  def queued(self):
+    return len(self.events) - self._next
+
+  def stop_listening(self):
+    for fd in list(self._fds):
+      self._close(fd)
+    if self._poll is not None:
+      self._poll.close()
+      self._poll = None
+
+  def listening(self):
+    return bool(self._fds)
+
+  def finished(self):
+    return not self._fds and self._next == len(self.events)
+
+  def read_mod_map(self):
+    """The kbd layout the key codes are named by."""
+    return self.layout
+
+
+def main(argv):
+  parser = optparse.OptionParser('Usage: %prog [Options...] device...')
+  parser.add_option('--kbd', default='us.kbd',
+                    help='Layout the key codes are named by.')
+  opts, paths = parser.parse_args(argv[1:])
+  source = EvdevSource(paths, opts.kbd)
+  source.start()
+  try:
+    while not source.finished():
+      event = source.next_event()
+      if event is None:
+        time.sleep(0.001)
+        continue
+      print '%.6f %s %s %s' % (event.time, event.type,
+                               key_ids.key_name(event.code), event.value)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    source.stop_listening()
+
+
+if __name__ == '__main__':
+  main(sys.argv)
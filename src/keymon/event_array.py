@@ -0,0 +1,115 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Recordings as NumPy record arrays, for the analysis code.
+
+Each event is one record of DTYPE: the type is an index into events.TYPES,
+the code a key_ids id, and motion events keep x in value and y in y.
+Arrays can be saved as binary .npy recordings; their key ids are those of the
+process that saved them.
+"""
+
+import numpy as np
+
+import events
+import key_ids
+import recording
+
+DTYPE = np.dtype([('time', 'f8'), ('type', 'i1'), ('code', 'i4'),
+                  ('value', 'i4'), ('y', 'i4')])
+
+EV_KEY, EV_REL, EV_MOV, EV_WIN, EV_REP = [
+    events.TYPES.index(atype)
+    for atype in ('EV_KEY', 'EV_REL', 'EV_MOV', 'EV_WIN', 'EV_REP')]
+
+
+def from_events(parsed):
+  """Build an array from (timestamp, type, key id, value) tuples."""
+  rows = []
+  type_index = events.TYPE_INDEX
+  for timestamp, atype, code, value in parsed:
+    if atype == 'EV_MOV':
+      rows.append((timestamp, EV_MOV, code, value[0], value[1]))
+    else:
+      rows.append((timestamp, type_index[atype], code, value, 0))
+  return np.array(rows, dtype=DTYPE)
+
+
+def load(fname):
+  """Read a recording file into an array."""
+  return from_events(recording.read_recording(fname))
+
+
+def save(fname, arr):
+  """Write an array as a binary .npy recording.
+
+  Key ids only hold inside one process, so the key names go next to it, one
+  per line in fname + '.keys'. np.save() adds a missing .npy to fname, so
+  it is added here first, for the key names to be found by open_binary().
+  Returns:
+    the name of the recording written.
+  """
+  if not fname.endswith('.npy'):
+    fname += '.npy'
+  np.save(fname, arr)
+  fout = open(fname + '.keys', 'w')
+  try:
+    fout.write(''.join('%s\n' % name for name in key_ids.key_names()))
+  finally:
+    fout.close()
+  return fname
+
+
+def open_binary(fname):
+  """Map a binary .npy recording, without reading it all into memory.
+  Returns:
+    (array, remap), remap[code in the file] is the key id in this process.
+  """
+  names = open(fname + '.keys').read().splitlines()
+  remap = np.array([key_ids.key_id(name) for name in names], dtype='i4')
+  return np.load(fname, mmap_mode='r'), remap
+
+
+def load_binary(fname):
+  """Read a binary .npy recording, with key ids of this process."""
+  arr, remap = open_binary(fname)
+  arr = np.array(arr)
+  arr['code'] = remap[arr['code']]
+  return arr
+
+
+def iter_events(arr, remap=None, chunk=65536):
+  """Yield the (timestamp, type, key id, value) tuples of an array.
+
+  Converts chunk records at a time, so a memory mapped array is never read in
+  whole.
+  """
+  for start in xrange(0, len(arr), chunk):
+    part = arr[start:start + chunk]
+    if remap is not None:
+      part = np.array(part)
+      part['code'] = remap[part['code']]
+    for event in to_events(part):
+      yield event
+
+
+def to_events(arr):
+  """The (timestamp, type, key id, value) tuples of an array."""
+  parsed = []
+  for timestamp, atype, code, value, y in arr.tolist():
+    atype = events.TYPES[atype]
+    if atype == 'EV_MOV':
+      value = (value, y)
+    parsed.append((timestamp, atype, code, value))
+  return parsed
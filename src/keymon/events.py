@@ -0,0 +1,48 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The event records passed from the capture backends to KeyMon."""
+
+# Event types, the compact stores keep the index into this.
+TYPES = ('EV_KEY', 'EV_REL', 'EV_MOV', 'EV_WIN', 'EV_REP')
+TYPE_INDEX = dict((atype, idx) for idx, atype in enumerate(TYPES))
+
+
+class XEvent(object):
+  """An event, mimics edev.py events.
+
+  One is allocated per captured event, so it has slots rather than a
+  __dict__ and plain attributes rather than properties:
+    type: 'EV_KEY', 'EV_REL', 'EV_MOV', 'EV_WIN' or 'EV_REP'
+    scancode: the scancode if any
+    code: the key id, see key_ids
+    value: 0 for up, 1 for down, etc. (x, y) for motion, the number of
+        repeats for EV_REP, see autorepeat.
+    window: id of the focused window, see window_tracker, 0 if unknown.
+    time: when the event happened, if the backend knows, e.g. the kernel
+        timestamp of evdev events. None stamps it when it is logged.
+  """
+  __slots__ = ('type', 'scancode', 'code', 'value', 'window', 'time')
+
+  def __init__(self, atype, scancode, code, value, window=0, time=None):
+    self.type = atype
+    self.scancode = scancode
+    self.code = code
+    self.value = value
+    self.window = window
+    self.time = time
+
+  def __str__(self):
+    return 'type:%s scancode:%s code:%s value:%s' % (self.type,
+        self.scancode, self.code, self.value)
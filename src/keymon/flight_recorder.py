@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keep the most recent events in memory and write them out on demand.
+
+The ring is a set of preallocated arrays, so memory is fixed when it is
+created and recording an event is a handful of array stores.
+"""
+
+import array
+import os
+import tempfile
+
+import recording
+from events import TYPES
+from events import TYPE_INDEX
+
+
+class FlightRecorder(object):
+  """A ring buffer of the last size events."""
+
+  def __init__(self, size):
+    self.size = size
+    self.times = array.array('d', [0.0]) * size
+    self.types = array.array('b', [0]) * size
+    self.codes = array.array('i', [0]) * size
+    self.values = array.array('i', [0]) * size
+    self.ys = array.array('i', [0]) * size  # y of motion events
+    self.count = 0  # events ever recorded
+
+  def record(self, timestamp, event):
+    """Store an event, overwriting the oldest one once full."""
+    idx = self.count % self.size
+    self.times[idx] = timestamp
+    self.types[idx] = TYPE_INDEX[event.type]
+    self.codes[idx] = event.code
+    if event.type == 'EV_MOV':
+      self.values[idx], self.ys[idx] = event.value
+    else:
+      self.values[idx] = event.value
+    self.count += 1
+
+  def snapshot(self, seconds=None):
+    """Return the buffered events, oldest first.
+    Args:
+      seconds: only the events of the last seconds before the newest one.
+    Returns:
+      list of (timestamp, type, key id, value)
+    """
+    filled = min(self.count, self.size)
+    start = self.count % self.size if self.count > self.size else 0
+    order = range(start, filled) + range(0, start)
+    times, types, codes = self.times, self.types, self.codes
+    values, ys = self.values, self.ys
+    events = []
+    for idx in order:
+      atype = TYPES[types[idx]]
+      if atype == 'EV_MOV':
+        value = (values[idx], ys[idx])
+      else:
+        value = values[idx]
+      events.append((times[idx], atype, codes[idx], value))
+    if seconds and events:
+      newest = events[-1][0]
+      events = [event for event in events if event[0] >= newest - seconds]
+    return events
+
+  def dump(self, path, seconds=None, preamble=()):
+    """Atomically write the buffered events as a recording.
+    Args:
+      path: the recording to write.
+      seconds: only the events of the last seconds before the newest one.
+      preamble: lines to write before the events, e.g. window descriptions.
+    Returns:
+      number of events written
+    """
+    events = self.snapshot(seconds)
+    fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path),
+                                    dir=os.path.dirname(path) or '.')
+    try:
+      fout = os.fdopen(fd, 'w')
+      fout.write(''.join(preamble))
+      fout.write(''.join(recording.format_fields(*event) for event in events))
+      fout.flush()
+      os.fsync(fout.fileno())
+      fout.close()
+      os.rename(tmp_path, path)
+    except:
+      os.unlink(tmp_path)
+      raise
+    return len(events)
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Follow a recording while KeyMon is still writing it.
+
+  for events in Follower('/tmp/prvak-log-*').batches():
+    ...
+
+Sleeps in inotify until the file changes, falling back to polling its stat
+where inotify is not available, and only parses the bytes appended since the
+last batch. A glob follows the newest matching file, so a restarted KeyMon is
+picked up; a path replaced by a new file or truncated is read from the start.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import glob
+import logging
+import os
+import select
+import struct
+import time
+
+import recording
+
+LOG = logging.getLogger('follow')
+
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_NONBLOCK = 0x800
+_IN_CLOEXEC = 0x80000
+_EVENT_HEADER = struct.Struct('iIII')
+
+_READ_SIZE = 1 << 16
+
+
+class _Inotify(object):
+  """Minimal ctypes inotify watching one directory."""
+
+  def __init__(self, directory):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+    mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+    if libc.inotify_add_watch(self.fd, directory, mask) < 0:
+      err = ctypes.get_errno()
+      os.close(self.fd)
+      raise OSError(err, 'inotify_add_watch %s failed' % directory)
+
+  def wait(self, timeout):
+    """Wait for changes.
+    Returns:
+      set of names in the directory that changed.
+    """
+    ready, unused_w, unused_x = select.select([self.fd], [], [], timeout)
+    names = set()
+    while ready:
+      try:
+        data = os.read(self.fd, _READ_SIZE)
+      except OSError as err:
+        if err.errno == errno.EAGAIN:
+          break
+        raise
+      pos = 0
+      while pos < len(data):
+        unused_wd, unused_mask, unused_cookie, size = (
+            _EVENT_HEADER.unpack_from(data, pos))
+        pos += _EVENT_HEADER.size
+        names.add(data[pos:pos + size].rstrip('\0'))
+        pos += size
+    return names
+
+  def close(self):
+    os.close(self.fd)
+
+
+class Follower(object):
+  """Yields batches of events appended to a recording."""
+
+  def __init__(self, pattern, from_start=True, poll_interval=1.0):
+    """
+    Args:
+      pattern: path of the recording, or a glob to follow the newest of.
+      from_start: parse what is already there, or only what comes next.
+      poll_interval: seconds between stat() calls without inotify.
+    """
+    self.pattern = pattern
+    self.poll_interval = poll_interval
+    self.path = None
+    self._fd = None
+    self._ino = None
+    self._offset = 0
+    self._partial = ''
+    self._stopped = False
+    try:
+      self._inotify = _Inotify(os.path.dirname(os.path.abspath(pattern)))
+    except (OSError, AttributeError) as err:
+      LOG.info('No inotify, polling every %.1fs: %s', poll_interval, err)
+      self._inotify = None
+    self._switch(from_start)
+
+  def _newest(self):
+    """The file to follow, or None if there is none yet."""
+    paths = glob.glob(self.pattern)
+    if not paths:
+      return None
+    return max(paths, key=lambda path: (os.path.getmtime(path), path))
+
+  def _switch(self, from_start=True):
+    """Start following the newest file, from its start or its end."""
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+    self.path = self._newest()
+    self._partial = ''
+    self._offset = 0
+    if self.path is None:
+      return
+    self._fd = os.open(self.path, os.O_RDONLY)
+    stat = os.fstat(self._fd)
+    self._ino = stat.st_ino
+    if not from_start:
+      self._offset = stat.st_size
+
+  def _rotated(self):
+    """Has the followed file been replaced or truncated?"""
+    newest = self._newest()
+    if newest is None:
+      return False
+    if newest != self.path:
+      return True
+    try:
+      stat = os.stat(self.path)
+    except OSError:
+      return False
+    return stat.st_ino != self._ino or stat.st_size < self._offset
+
+  def read_new(self):
+    """Parse the complete lines appended since the last call.
+    Returns:
+      list of (timestamp, type, key id, value)
+    """
+    if self._fd is None:
+      self._switch()
+      if self._fd is None:
+        return []
+    events = self._read_fd()
+    if self._rotated():
+      self._switch()
+      events.extend(self._read_fd())
+    return events
+
+  def _read_fd(self):
+    chunks = [self._partial]
+    while True:
+      os.lseek(self._fd, self._offset, os.SEEK_SET)
+      data = os.read(self._fd, _READ_SIZE)
+      if not data:
+        break
+      chunks.append(data)
+      self._offset += len(data)
+    data = ''.join(chunks)
+    end = data.rfind('\n') + 1
+    self._partial = data[end:]
+    events = []
+    for line in data[:end].splitlines():
+      event = recording.parse_line(line)
+      if event:
+        events.append(event)
+    return events
+
+  def _wait(self, timeout):
+    """Sleep until the followed file may have changed."""
+    if self._inotify is None:
+      time.sleep(min(timeout, self.poll_interval))
+      return
+    end = time.time() + timeout
+    wanted = os.path.basename(self.pattern)
+    while timeout > 0:
+      for name in self._inotify.wait(timeout):
+        if fnmatch.fnmatch(name, wanted):
+          return
+      timeout = end - time.time()
+
+  def batches(self, timeout=None):
+    """Yield non empty lists of new events as they are appended.
+    Args:
+      timeout: stop after this many seconds without new events, or never.
+    """
+    idle_since = time.time()
+    while not self._stopped:
+      events = self.read_new()
+      if events:
+        idle_since = time.time()
+        yield events
+        continue
+      wait = 3600.0
+      if timeout is not None:
+        wait = idle_since + timeout - time.time()
+        if wait <= 0:
+          return
+      self._wait(wait)
+
+  def stop(self):
+    """Make batches() return after the current wait."""
+    self._stopped = True
+
+  def close(self):
+    self.stop()
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+    if self._inotify is not None:
+      self._inotify.close()
+      self._inotify = None
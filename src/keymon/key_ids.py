@@ -0,0 +1,57 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Interned integer ids for key names.
+
+Capture, the log writer and the analysis code pass keys around as small
+integers, the 'KEY_*' names are only looked up when reading or writing text.
+Ids are assigned in the order names are first seen, so they are only
+meaningful inside one process; convert back to names before results leave it.
+"""
+
+# Motion events carry no key, they are logged with a code of 0.
+NO_KEY = 0
+
+_names = ['0']
+_ids = {'0': NO_KEY}
+
+
+def key_id(name):
+  """Return the id of a key name, interning it on first use."""
+  try:
+    return _ids[name]
+  except KeyError:
+    _ids[name] = len(_names)
+    _names.append(name)
+    return _ids[name]
+
+
+def find_id(name):
+  """Return the id of a key name, or None if it was never interned."""
+  return _ids.get(name)
+
+
+def key_name(key):
+  """Return the name of a key id."""
+  return _names[key]
+
+
+def key_names():
+  """Return the list of names, indexed by id."""
+  return list(_names)
+
+
+def count():
+  """Number of ids handed out so far."""
+  return len(_names)
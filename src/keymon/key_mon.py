@@ -22,11 +22,14 @@ Shows their status graphically.
 __author__ = 'Scott Kirkwood (scott+keymon@forusers.com)'
 __version__ = '1.17'
 
+import fcntl
 import logging
+import os
 import pygtk
 pygtk.require('2.0')
 import gobject
 import gtk
+import signal
 import sys
 import time
 try:
@@ -35,13 +38,26 @@ except ImportError:
   print 'Error: Missing xlib, run sudo apt-get install python-xlib'
   sys.exit(-1)
 
+import autorepeat
+import evdev
+import flight_recorder
 import options
+import key_ids
+import memory
 import mod_mapper
+import motion_codec
+import recording
 import settings
+import sources
+import window_tracker
+from events import XEvent
 
 from ConfigParser import SafeConfigParser
 
 class KeyMon:
+  # Most events handled per idle call, so a backlog can't starve gtk.
+  IDLE_BATCH = 1000
+
   def __init__(self, options):
     """Options dict:
       meta: boolean show the meta (windows key)
@@ -54,25 +70,91 @@ class KeyMon:
 
     self.MODS = ['SHIFT', 'CTRL', 'META', 'ALT']
 
+    self.devices = create_devices(self.options)
+
     self.options.kbd_files = settings.get_kbd_files()
-    self.modmap = mod_mapper.safely_read_mod_map(self.options.kbd_file, self.options.kbd_files)
+    self.modmap = mod_mapper.safely_read_mod_map(self.options.kbd_file,
+        self.options.kbd_files, self.devices)
+
+    self.windows = None
+    self._window = 0
+    self._windows_logged = 1
+    if self.options.track_windows:
+      self.windows = window_tracker.WindowTracker()
+      self.windows.start()
+      self.devices.windows = self.windows
+
+    self.autorepeat = None
+    if self.options.autorepeat != 'keep':
+      self.autorepeat = autorepeat.AutoRepeatFilter(self.options.autorepeat)
+      self.devices.autorepeat = self.autorepeat
 
-    self.devices = xlib.XEvents()
     self.devices.start()
 
-    path = '/tmp/prvak-log-%s' % time.strftime('%Y%m%d-%H%M%S', time.gmtime())
-    print 'Logging into: %s' % path
-    self.event_log = open(path, 'w')
+    self.recorder = None
+    self._dump_requested = False
+    self._dumps = 0
+    if self.options.flight_recorder:
+      self.recorder = flight_recorder.FlightRecorder(
+          self.options.flight_recorder)
+      signal.signal(signal.SIGUSR1, self.request_dump)
+      self._wake_on_signals()
+      print 'Keeping the last %d events, kill -USR1 %d to dump them' % (
+          self.options.flight_recorder, os.getpid())
+    else:
+      path = self.log_path()
+      print 'Logging into: %s' % path
+      self.event_log = open(path, 'w')
+    self.motion_log = None
+    if self.options.motion_codec and not self.recorder:
+      print 'Logging motion into: %s' % recording.motion_path(path)
+      self.motion_log = motion_codec.MotionEncoder(
+          open(recording.motion_path(path), 'wb'))
+      gobject.timeout_add(int(motion_codec.BLOCK_SECONDS * 1000),
+                          self.motion_log.on_timer)
+
+    self.memory = None
+    if self.options.memory_stats:
+      print 'Memory samples into: %s' % self.options.memory_stats
+      self.memory = memory.MemoryMonitor(
+          self.devices, self.options.memory_stats,
+          rss_alarm=self.options.rss_alarm_mb * 1048576,
+          queue_alarm=self.options.queue_alarm,
+          count_objects=self.options.memory_objects)
+      gobject.timeout_add(int(self.options.memory_interval * 1000),
+                          self.memory.on_timer)
 
     self.add_events()
 
+  def log_path(self):
+    """The file to log into, the --log_path or a new /tmp/prvak-log-*."""
+    if self.options.log_path:
+      return self.options.log_path
+    return '/tmp/prvak-log-%s' % time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+
+  def dump_path(self):
+    """A new file for a flight recorder dump, /tmp/prvak-dump-<time>-<n>,
+    in the directory of --log_path if that is set. n counts the dumps, so
+    two in the same second don't overwrite each other."""
+    self._dumps += 1
+    directory = '/tmp'
+    if self.options.log_path:
+      directory = os.path.dirname(os.path.abspath(self.options.log_path))
+    return os.path.join(directory, 'prvak-dump-%s-%d' % (
+        time.strftime('%Y%m%d-%H%M%S', time.gmtime()), self._dumps))
+
   def get_option(self, attr):
     """Shorthand for getattr(self.options, attr)"""
     return getattr(self.options, attr)
 
   def add_events(self):
     """Add events for the window to listen to."""
-    gobject.idle_add(self.on_idle)
+    self._idle_pending = False
+    fd = self.devices.fileno()
+    if fd is None:
+      gobject.idle_add(self.on_idle)
+    else:
+      gobject.io_add_watch(fd, gobject.IO_IN, self.on_readable)
 
   def pointer_leave(self, unused_widget, unused_evt):
 
@@ -80,25 +162,151 @@ class KeyMon:
 
   def on_idle(self):
     """Check for events on idle."""
-    event = self.devices.next_event()
     try:
-      if event:
-        self.handle_event(event)
+      if self._dump_requested:
+        self.dump_recorder()
+      if self._handle_batch():
+        return True
+      if self.devices.finished():
+        self.quit_program()
+        return False
+      if self.devices.fileno() is not None:
+        # The backlog is done, on_readable() takes it from here.
+        self._idle_pending = False
+        return False
       time.sleep(0.001)
     except KeyboardInterrupt:
       self.quit_program()
       return False
     return True  # continue calling
 
+  def on_readable(self, unused_fd, unused_condition):
+    """Read the events waiting on the source and handle them right away."""
+    try:
+      if self._dump_requested:
+        self.dump_recorder()
+      self.devices.read_ready()
+      if self._handle_batch():
+        if not self._idle_pending:
+          # More than a batch arrived, finish it from idle calls.
+          self._idle_pending = True
+          gobject.idle_add(self.on_idle)
+      else:
+        if self.autorepeat and self.autorepeat.held():
+          # Nothing may wake us up before the held releases are due.
+          gobject.timeout_add(int(self.autorepeat.hold * 1000) + 1,
+                              self.on_hold_timeout)
+        if self.devices.finished():
+          self.quit_program()
+          return False
+    except KeyboardInterrupt:
+      self.quit_program()
+      return False
+    return True
+
+  def on_hold_timeout(self):
+    """Handle the releases the autorepeat filter held long enough."""
+    self._handle_batch()
+    return False
+
+  def _handle_batch(self):
+    """Handle up to IDLE_BATCH queued events, flushing the log once.
+    Returns:
+      True if there may be more.
+    """
+    handled = 0
+    while handled < self.IDLE_BATCH:
+      event = self.devices.next_event()
+      if not event:
+        break
+      self.handle_event(event)
+      handled += 1
+    if handled and not self.recorder:
+      self.event_log.flush()
+    return handled == self.IDLE_BATCH
+
   def _log_event(self, event):
-    self.event_log.write('%.5f;%s;%s;%s\n' % (
-        time.time(), event.type, event.code, event.value))
-    self.event_log.flush()
+    timestamp = event.time
+    if timestamp is None:
+      timestamp = time.time()
+    if self.motion_log and event.type == 'EV_MOV':
+      self.motion_log.add(timestamp, *event.value)
+      return
+    self.event_log.write(recording.format_event(timestamp, event))
 
   def handle_event(self, event):
     """Handle an X event."""
+    if self.windows and event.window != self._window:
+      self._window_changed(event.window, event.time)
+    self._record(event)
+
+  def _record(self, event):
+    """Log the event, or keep it in the flight recorder."""
+    if self.recorder:
+      timestamp = event.time
+      if timestamp is None:
+        timestamp = time.time()
+      self.recorder.record(timestamp, event)
+    else:
+      self._log_event(event)
+
+  def _window_changed(self, window, timestamp):
+    """Note that the focus moved to another window id at timestamp."""
+    self._window = window
+    if not self.recorder:
+      lines = self.window_table(self._windows_logged)
+      self.event_log.write(''.join(lines))
+      self._windows_logged += len(lines)
+    self._record(XEvent('EV_WIN', 0, key_ids.NO_KEY, window, window,
+                        timestamp))
+
+  def window_table(self, first=1):
+    """Lines describing the tracked window ids, from first on."""
+    windows = self.windows.windows
+    return [recording.format_window(window, *windows[window])
+            for window in range(first, len(windows))]
+
+  def _wake_on_signals(self):
+    """Make signals wake the main loop.
+
+    Python handlers only run once gtk returns to Python code, which with
+    an fd driven source is the next input event. The interpreter writes a
+    byte to the wakeup pipe on every signal, and watching the pipe gets
+    the handler and the dump it asks for run right away.
+    """
+    wake_read, wake_write = os.pipe()
+    for fd in (wake_read, wake_write):
+      fcntl.fcntl(fd, fcntl.F_SETFL,
+                  fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    signal.set_wakeup_fd(wake_write)
+    gobject.io_add_watch(wake_read, gobject.IO_IN, self.on_wakeup)
+
+  def on_wakeup(self, fd, unused_condition):
+    """A signal arrived, act on what its handler asked for."""
+    try:
+      os.read(fd, 512)
+    except OSError:
+      pass
+    if self._dump_requested:
+      self.dump_recorder()
+    return True
+
+  def request_dump(self, *unused_args):
+    """Signal handler, dumps the flight recorder from the main loop."""
+    self._dump_requested = True
 
-    self._log_event(event)
+  def dump_recorder(self):
+    """Write the flight recorder window to a new log file."""
+    self._dump_requested = False
+    path = self.dump_path()
+    start = time.time()
+    preamble = ()
+    if self.windows:
+      preamble = self.window_table()
+    count = self.recorder.dump(path, self.options.flight_seconds, preamble)
+    logging.info('Dumped %d events into %s in %.3fs', count, path,
+                 time.time() - start)
+    print 'Dumped %d events into: %s' % (count, path)
 
   def quit_program(self, *unused_args):
     """Quit the program."""
@@ -108,8 +316,32 @@ class KeyMon:
   def destroy(self, unused_widget, unused_data=None):
     """Also quit the program."""
     self.devices.stop_listening()
+    if self.autorepeat:
+      for event in self.autorepeat.flush():
+        self.handle_event(event)
+    if not self.recorder:
+      self.event_log.flush()
+    if self.motion_log:
+      self.motion_log.flush()
     gtk.main_quit()
 
+def create_devices(options):
+  """Create the event source the options ask for, X RECORD by default."""
+  if options.replay:
+    return sources.ReplaySource(options.replay, options.replay_scale)
+  if options.synthetic:
+    if options.burstiness < 0:
+      raise ValueError('Invalid burstiness: %s' % options.burstiness)
+    return sources.SyntheticSource(options.key_rate, options.motion_rate,
+                                   options.burstiness)
+  if options.evdev:
+    return evdev.EvdevSource(options.evdev.split(','),
+                             options.kbd_file or 'us.kbd')
+  if options.capture == 'select':
+    return xlib.XEventsAsync()
+  return xlib.XEvents()
+
+
 def create_options():
   opts = options.Options()
 
@@ -123,6 +355,74 @@ def create_options():
                   default=None,
                   help='Use this kbd filename.')
 
+  opts.add_option(opt_long='--capture', dest='capture', default='thread',
+                  help='How to read X events: "thread" blocks a thread in '
+                       'RECORD, "select" reads them in the main loop when '
+                       'the X connection is readable.')
+  opts.add_option(opt_long='--log_path', dest='log_path', default=None,
+                  help='Log into this file instead of /tmp/prvak-log-*.')
+  opts.add_option(opt_long='--motion_codec', dest='motion_codec',
+                  type='bool', default=False,
+                  help='Log mouse motion delta encoded into a .mov file '
+                       'next to the log instead of as text lines.')
+  opts.add_option(opt_long='--autorepeat', dest='autorepeat', default='keep',
+                  help='What to do with key autorepeat: "keep" logs every '
+                       'repeat, "drop" only the first press and the real '
+                       'release, "collapse" also an EV_REP event counting '
+                       'the repeats.')
+  opts.add_option(opt_long='--track_windows', dest='track_windows',
+                  type='bool', default=False,
+                  help='Log which window has the focus.')
+  opts.add_option(opt_long='--flight_recorder', dest='flight_recorder',
+                  type='int', default=0,
+                  help='Keep only the last N events in memory, and write '
+                       'them out on SIGUSR1 instead of logging to disk, '
+                       'into a new prvak-dump-* file each time.')
+  opts.add_option(opt_long='--flight_seconds', dest='flight_seconds',
+                  type='float', default=0.0,
+                  help='Only dump the flight recorder events of the last '
+                       'this many seconds, 0 dumps all.')
+  opts.add_option(opt_long='--memory_stats', dest='memory_stats',
+                  default=None,
+                  help='Append RSS and event queue samples to this file.')
+  opts.add_option(opt_long='--memory_interval', dest='memory_interval',
+                  type='float', default=60.0,
+                  help='Seconds between memory samples.')
+  opts.add_option(opt_long='--memory_objects', dest='memory_objects',
+                  type='bool', default=False,
+                  help='Also count the live events in each memory sample, '
+                       'and without tracemalloc the live objects by type. '
+                       'Walks every object.')
+  opts.add_option(opt_long='--rss_alarm_mb', dest='rss_alarm_mb', type='int',
+                  default=0,
+                  help='Warn when the RSS reaches this many MB, 0 never.')
+  opts.add_option(opt_long='--queue_alarm', dest='queue_alarm', type='int',
+                  default=0,
+                  help='Warn when this many events are waiting to be '
+                       'logged, 0 never.')
+  opts.add_option(opt_long='--replay', dest='replay', default=None,
+                  help='Replay this recording instead of capturing from X.')
+  opts.add_option(opt_long='--replay_scale', dest='replay_scale',
+                  type='float', default=1.0,
+                  help='Multiply the replayed inter-event times by this, '
+                       '0 replays as fast as possible.')
+  opts.add_option(opt_long='--evdev', dest='evdev', default=None,
+                  help='Comma separated evdev devices, e.g. '
+                       '/dev/input/event3, to read instead of X. Files and '
+                       'pipes of recorded input_events work too.')
+  opts.add_option(opt_long='--synthetic', dest='synthetic', type='bool',
+                  default=False,
+                  help='Log generated typing and mouse motion instead of '
+                       'capturing from X.')
+  opts.add_option(opt_long='--key_rate', dest='key_rate', type='float',
+                  default=10.0, help='Synthetic key strokes per second.')
+  opts.add_option(opt_long='--motion_rate', dest='motion_rate', type='float',
+                  default=50.0, help='Synthetic motion events per second.')
+  opts.add_option(opt_long='--burstiness', dest='burstiness', type='float',
+                  default=1.0,
+                  help='Coefficient of variation of synthetic event gaps, '
+                       '1 is a Poisson stream, 0 evenly spaced.')
+
   opts.add_option(opt_short=None, opt_long=None, type='int',
                   dest='x_pos', default=-1, help='Last X Position')
   opts.add_option(opt_short=None, opt_long=None, type='int',
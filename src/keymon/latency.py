@@ -0,0 +1,305 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End to end capture latency under Xvfb.
+
+Starts a private Xvfb, runs key_mon.py against it and injects key and motion
+events through XTEST at fixed rates. Every injected event is matched with its
+line in the log, and two latencies are taken from the injection time:
+  - log: until the line shows up in the log, which a thread following the
+    file notes. This is end to end, queueing, main loop wakeups and the
+    autorepeat hold all count.
+  - capture: until the time on the line, when the capture engine decoded
+    the event. A backlog in KeyMon delays the line but not this time.
+The rates are judged by the log latency.
+
+  python latency.py --rates=100,1000,5000 --max_p99_ms=20
+  python latency.py --engines=thread,select
+
+Exits with 1 if any rate loses events or is over --max_p99_ms, so it can gate
+changes to the capture path.
+"""
+
+import optparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from Xlib import X
+from Xlib import display
+
+import follow
+import key_ids
+import xlib
+
+# Keys injected, in turn. Letters map to the same keysym on every layout.
+_KEYCODE_NAMES = 'qwertyuiopasdfghjklzxcvbnm'
+# Log lines past the last match an injected event is looked for in. Key
+# events repeat every 2 * len(_KEYCODE_NAMES), and a bound well below that
+# keeps a lost event from being paired with a later identical one.
+MATCH_WINDOW = 8
+
+
+def start_xvfb():
+  """Start Xvfb on the first free display.
+  Returns:
+    (Popen, display name)
+  """
+  for num in range(90, 200):
+    if os.path.exists('/tmp/.X11-unix/X%d' % num) or os.path.exists(
+        '/tmp/.X%d-lock' % num):
+      continue
+    name = ':%d' % num
+    proc = subprocess.Popen(['Xvfb', name, '-nolisten', 'tcp',
+                             '+extension', 'RECORD', '+extension', 'XTEST'],
+                            stdout=open(os.devnull, 'w'),
+                            stderr=subprocess.STDOUT)
+    for unused_i in range(100):
+      if os.path.exists('/tmp/.X11-unix/X%d' % num):
+        return proc, name
+      if proc.poll() is not None:
+        break
+      time.sleep(0.05)
+    proc.kill()
+  raise RuntimeError('Unable to start Xvfb')
+
+
+class Injector(object):
+  """Sends key and motion events through XTEST, noting when each was sent."""
+
+  def __init__(self, name, motion_ratio=0.0):
+    self.disp = display.Display(name)
+    if not self.disp.has_extension('XTEST'):
+      raise RuntimeError('XTEST extension not found')
+    self.motion_ratio = motion_ratio
+    names = xlib.keysym_names()
+    self.keys = []
+    for char in _KEYCODE_NAMES:
+      keysym = ord(char)
+      keycode = self.disp.keysym_to_keycode(keysym)
+      self.keys.append((keycode, 'KEY_' + names[keysym].upper()))
+    self._count = 0
+    self._key_events = 0
+    self._motion = 0.0
+
+  def _next(self):
+    """The next event to send, as (X event type, detail, x, y, expected)."""
+    self._count += 1
+    self._motion += self.motion_ratio
+    if self._motion >= 1:
+      self._motion -= 1
+      x, y = self._count % 997 + 1, self._count % 499 + 1
+      return X.MotionNotify, 0, x, y, ('EV_MOV', '0', (x, y))
+    self._key_events += 1
+    keycode, name = self.keys[(self._key_events // 2) % len(self.keys)]
+    if self._key_events % 2:
+      return X.KeyPress, keycode, 0, 0, ('EV_KEY', name, 1)
+    return X.KeyRelease, keycode, 0, 0, ('EV_KEY', name, 0)
+
+  def send(self, count, rate):
+    """Send count events at rate per second.
+    Returns:
+      list of (injection time, expected (type, code name, value))
+    """
+    sent = []
+    start = time.time()
+    for i in xrange(count):
+      due = start + float(i) / rate
+      while time.time() < due:
+        pass
+      etype, detail, x, y, expected = self._next()
+      self.disp.xtest_fake_input(etype, detail, x=x, y=y)
+      self.disp.flush()
+      sent.append((time.time(), expected))
+    # Leave every key up.
+    if self._key_events % 2:
+      motion_ratio, self.motion_ratio = self.motion_ratio, 0.0
+      etype, detail, x, y, expected = self._next()
+      self.disp.xtest_fake_input(etype, detail, x=x, y=y)
+      self.motion_ratio = motion_ratio
+    self.disp.sync()
+    return sent
+
+
+class LogWatcher(threading.Thread):
+  """Follows the log, noting when each line shows up in it.
+
+  lines holds (time read, timestamp on the line, (type, code name, value)).
+  The follower sleeps in inotify, so a line is read right after KeyMon
+  flushes it.
+  """
+
+  def __init__(self, path):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.setName('Log-thread')
+    self.follower = follow.Follower(path, poll_interval=0.001)
+    self.lines = []
+
+  def run(self):
+    for events in self.follower.batches():
+      now = time.time()
+      for timestamp, atype, code, value in events:
+        self.lines.append(
+            (now, timestamp, (atype, key_ids.key_name(code), value)))
+
+  def stop(self):
+    self.follower.stop()
+
+
+def match(sent, logged, window=MATCH_WINDOW):
+  """Pair injected events with their LogWatcher lines, in order.
+
+  An injected event is looked for in the window log lines after the last
+  match. That skips the few lines nobody injected, like the key releases
+  ending a run, but stops short of the next identical event.
+  Returns:
+    (list of log latencies, list of capture latencies, number of injected
+    events not logged), latencies in seconds.
+  """
+  log_latencies = []
+  capture_latencies = []
+  lost = 0
+  j = 0
+  for sent_time, expected in sent:
+    end = min(j + window, len(logged))
+    k = j
+    while k < end and logged[k][2] != expected:
+      k += 1
+    if k == end:
+      lost += 1
+      continue
+    log_latencies.append(logged[k][0] - sent_time)
+    capture_latencies.append(logged[k][1] - sent_time)
+    j = k + 1
+  return log_latencies, capture_latencies, lost
+
+
+def percentile(values, fraction):
+  """The value below which fraction of the sorted values fall."""
+  if not values:
+    return float('nan')
+  return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Harness(object):
+  """Xvfb, a key_mon.py logging into a temporary file and an Injector."""
+
+  def __init__(self, motion_ratio=0.0, keymon_args=()):
+    self.xvfb, self.name = start_xvfb()
+    fd, self.log_path = tempfile.mkstemp(prefix='pianist-latency-')
+    os.close(fd)
+    env = dict(os.environ, DISPLAY=self.name)
+    self.keymon = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__), 'key_mon.py'),
+         '--log_path', self.log_path] + list(keymon_args),
+        env=env, stdout=open(os.devnull, 'w'))
+    self.injector = Injector(self.name, motion_ratio)
+    self.watcher = LogWatcher(self.log_path)
+    self.watcher.start()
+    self._logged = 0
+
+  def wait_ready(self, timeout=10.0):
+    """Inject until KeyMon logs, i.e. its RECORD context is enabled."""
+    end = time.time() + timeout
+    while time.time() < end:
+      self.injector.send(2, 100)
+      time.sleep(0.1)
+      self._logged = len(self.watcher.lines)
+      if self._logged:
+        return
+    raise RuntimeError('key_mon.py did not log anything')
+
+  def run(self, count, rate, settle=1.0):
+    """Inject count events at rate.
+    Returns:
+      (sorted log latencies, sorted capture latencies, number lost)
+    """
+    sent = self.injector.send(count, rate)
+    time.sleep(settle)
+    logged = self.watcher.lines[:]
+    new, self._logged = logged[self._logged:], len(logged)
+    log_latencies, capture_latencies, lost = match(sent, new)
+    return sorted(log_latencies), sorted(capture_latencies), lost
+
+  def close(self):
+    self.watcher.stop()
+    for proc in (self.keymon, self.xvfb):
+      if proc.poll() is None:
+        proc.terminate()
+        proc.wait()
+    os.unlink(self.log_path)
+
+
+def measure(opts, keymon_args):
+  """Run the injection rates of opts against one key_mon.py.
+  Returns:
+    True if a rate lost events or was over --max_p99_ms.
+  """
+  harness = Harness(opts.motion_ratio, keymon_args)
+  failed = False
+  sustained = None
+  try:
+    harness.wait_ready()
+    print '%8s %8s %6s %9s %9s %9s %9s %11s %11s' % (
+        'rate', 'logged', 'lost', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+        'capture p50', 'capture p99')
+    for rate in [int(rate) for rate in opts.rates.split(',')]:
+      latencies, capture, lost = harness.run(opts.count, rate)
+      p99 = percentile(latencies, 0.99) * 1000
+      print '%8d %8d %6d %9.2f %9.2f %9.2f %9.2f %11.2f %11.2f' % (
+          rate, len(latencies), lost,
+          percentile(latencies, 0.5) * 1000,
+          percentile(latencies, 0.9) * 1000, p99,
+          percentile(latencies, 1.0) * 1000,
+          percentile(capture, 0.5) * 1000,
+          percentile(capture, 0.99) * 1000)
+      if lost or (opts.max_p99_ms is not None and p99 > opts.max_p99_ms):
+        failed = True
+      elif not failed:
+        sustained = rate
+  finally:
+    harness.close()
+  print 'Max sustainable rate: %s events/s' % sustained
+  return failed
+
+
+def main(argv):
+  parser = optparse.OptionParser('Usage: %prog [Options...]')
+  parser.add_option('--rates', default='100,500,1000,2000,5000,10000',
+                    help='Comma separated injection rates, events per second.')
+  parser.add_option('--count', type='int', default=2000,
+                    help='Events injected per rate.')
+  parser.add_option('--motion_ratio', type='float', default=0.0,
+                    help='Fraction of injected events that are motion.')
+  parser.add_option('--engines', default='thread',
+                    help='Comma separated key_mon.py --capture engines to '
+                         'measure, e.g. thread,select to compare them.')
+  parser.add_option('--max_p99_ms', type='float', default=None,
+                    help='Fail if the 99th percentile log latency is above '
+                         'this.')
+  opts, unused_args = parser.parse_args(argv[1:])
+
+  failed = False
+  for engine in opts.engines.split(','):
+    print 'Capture engine: %s' % engine
+    failed |= measure(opts, ['--capture', engine])
+  return int(failed)
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,255 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Estimate how recorded typing would go on other keyboard layouts.
+
+Digraph counts and press to press times are collected from recordings once.
+The times seen on the layout they were typed on fit a cost per pair of key
+positions, from the finger, hand and row of each (see GEOMETRY). A candidate
+layout is then an array giving the position of every recorded key, and its
+score, the expected seconds spent on the recorded digraphs, is a couple of
+NumPy gathers. Whole batches of candidates are scored at once, which is what
+the parallel search builds on.
+
+  python layout_eval.py [--search] recording...
+"""
+
+import glob
+import multiprocessing
+import optparse
+import os
+import sys
+
+import numpy as np
+
+import event_array
+import key_ids
+import mod_mapper
+
+# Scancode -> (row, column) of the keys a layout moves symbols between.
+GEOMETRY = dict(
+    [(41, (0, 0))] + [(code, (0, code - 1)) for code in range(2, 14)] +
+    [(code, (1, code - 15)) for code in range(16, 28)] + [(43, (1, 13))] +
+    [(code, (2, code - 29)) for code in range(30, 41)] +
+    [(code, (3, code - 43)) for code in range(44, 54)] + [(57, (4, 6))])
+# Positions a search may swap: the letter block.
+SEARCH_CODES = range(16, 26) + range(30, 40) + range(44, 51)
+# Column -> finger, 0-3 left pinky to index, 4-7 right index to pinky.
+_FINGERS = [0, 0, 1, 2, 3, 3, 4, 4, 5, 6, 7, 7, 7, 7]
+_THUMB = 8
+# Gap between presses above which they are not a digraph, in seconds.
+MAX_GAP = 1.0
+# Observed pairs needed before their mean time replaces the fitted cost.
+MIN_SAMPLES = 5
+
+
+def positions():
+  """Scancodes of the positions, in position index order."""
+  return sorted(GEOMETRY)
+
+
+def _features(codes):
+  """Features of every pair of positions, shape (n, n, features)."""
+  rows = np.array([GEOMETRY[code][0] for code in codes])
+  cols = np.array([GEOMETRY[code][1] for code in codes])
+  fingers = np.array([_THUMB if row == 4 else _FINGERS[col]
+                      for row, col in zip(rows, cols)])
+  hands = np.where(fingers == _THUMB, -1, fingers // 4)
+  same_key = np.eye(len(codes))
+  same_finger = (fingers[:, None] == fingers[None, :]) - same_key
+  same_hand = (hands[:, None] == hands[None, :]) & (hands[:, None] >= 0)
+  row_jump = np.abs(rows[:, None] - rows[None, :]) * same_hand
+  pinky = np.isin(fingers, (0, 7))[None, :].repeat(len(codes), 0)
+  top = (rows <= 1)[None, :].repeat(len(codes), 0)
+  ones = np.ones((len(codes), len(codes)))
+  return np.dstack([ones, same_key, same_finger, same_hand, row_jump,
+                    pinky, top]).astype(float)
+
+
+class Corpus(object):
+  """Digraph counts and timings of recorded typing.
+
+  symbols are the key names typed, digraphs[i, j] counts i followed by j
+  and times[i, j] sums the seconds between their presses.
+  """
+
+  def __init__(self, symbols):
+    self.symbols = list(symbols)
+    size = len(self.symbols)
+    self.digraphs = np.zeros((size, size))
+    self.times = np.zeros((size, size))
+
+  def add(self, arr):
+    """Count the presses of an event_array."""
+    lookup = np.full(key_ids.count(), -1, dtype=int)
+    for idx, name in enumerate(self.symbols):
+      lookup[key_ids.key_id(name)] = idx
+    presses = arr[(arr['type'] == event_array.EV_KEY) & (arr['value'] == 1)]
+    symbols = lookup[presses['code']]
+    gaps = np.diff(presses['time'])
+    pairs = (symbols[:-1] >= 0) & (symbols[1:] >= 0) & (gaps < MAX_GAP)
+    first, second = symbols[:-1][pairs], symbols[1:][pairs]
+    np.add.at(self.digraphs, (first, second), 1)
+    np.add.at(self.times, (first, second), gaps[pairs])
+    return self
+
+
+def layout_codes(kbd_file):
+  """{key name: scancode} of a kbd layout, for the positions in GEOMETRY."""
+  layout = mod_mapper.read_kdb(kbd_file)
+  return dict((layout[code][0], code) for code in layout if code in GEOMETRY)
+
+
+class Evaluator(object):
+  """Scores layouts against a corpus typed on a known layout."""
+
+  def __init__(self, corpus, typed_on='us.kbd'):
+    self.corpus = corpus
+    self.codes = positions()
+    self.index = dict((code, idx) for idx, code in enumerate(self.codes))
+    features = _features(self.codes)
+    # Fit seconds per digraph from the pairs typed on the known layout.
+    typed = self.layout(typed_on)
+    placed = typed < len(self.codes)
+    weights = np.sqrt(corpus.digraphs[placed][:, placed])
+    observed = corpus.times[placed][:, placed] / np.maximum(
+        corpus.digraphs[placed][:, placed], 1)
+    pair_features = features[typed[placed][:, None], typed[placed][None, :]]
+    mask = weights > 0
+    coef = np.linalg.lstsq(pair_features[mask] * weights[mask][:, None],
+                           observed[mask] * weights[mask], rcond=None)[0]
+    cost = features.dot(coef)
+    # Pairs seen often enough keep their observed time.
+    firsts, seconds = np.nonzero(
+        corpus.digraphs[placed][:, placed] >= MIN_SAMPLES)
+    cost[typed[placed][firsts], typed[placed][seconds]] = observed[
+        firsts, seconds]
+    # The last position stands for keys a layout does not have.
+    size = len(self.codes)
+    self.cost = np.full((size + 1, size + 1), cost.max())
+    self.cost[:size, :size] = cost
+    self.coef = coef
+    # Only the digraphs that occur matter, most of the matrix is zeros.
+    self._pairs = np.nonzero(corpus.digraphs)
+    self._counts = corpus.digraphs[self._pairs]
+
+  def layout(self, kbd_file):
+    """Position index of every corpus symbol on a kbd layout."""
+    codes = layout_codes(kbd_file)
+    missing = len(self.codes)
+    return np.array([self.index.get(codes.get(symbol), missing)
+                     for symbol in self.corpus.symbols])
+
+  def score(self, candidates):
+    """Expected seconds spent on the corpus digraphs.
+    Args:
+      candidates: position indices, shape (symbols,) or (n, symbols).
+    Returns:
+      a score, or an array of n scores.
+    """
+    candidates = np.asarray(candidates)
+    firsts, seconds = self._pairs
+    pair_costs = self.cost[candidates[..., firsts], candidates[..., seconds]]
+    return pair_costs.dot(self._counts)
+
+
+def _search(args):
+  """Hill climb by scoring batches of random swaps, best swap wins."""
+  evaluator, start, iterations, batch, seed = args
+  rng = np.random.RandomState(seed)
+  current = np.array(start)
+  best = evaluator.score(current)
+  movable = np.flatnonzero(np.isin(
+      current, [evaluator.index[code] for code in SEARCH_CODES]))
+  for unused_i in xrange(iterations):
+    swaps = rng.randint(len(movable), size=(batch, 2))
+    candidates = np.repeat(current[None, :], batch, 0)
+    rows = np.arange(batch)
+    first, second = movable[swaps[:, 0]], movable[swaps[:, 1]]
+    candidates[rows, first] = current[second]
+    candidates[rows, second] = current[first]
+    scores = evaluator.score(candidates)
+    winner = scores.argmin()
+    if scores[winner] < best:
+      best = scores[winner]
+      current = candidates[winner]
+  return best, current
+
+
+def search(evaluator, start, processes=None, iterations=200, batch=512,
+           seeds=None):
+  """Search for better layouts from several random seeds in parallel.
+  Returns:
+    (best score, position indices) of the best run.
+  """
+  if seeds is None:
+    seeds = range(processes or multiprocessing.cpu_count())
+  tasks = [(evaluator, start, iterations, batch, seed) for seed in seeds]
+  if processes == 1:
+    results = map(_search, tasks)
+  else:
+    pool = multiprocessing.Pool(processes)
+    try:
+      results = pool.map(_search, tasks)
+    finally:
+      pool.close()
+      pool.join()
+  return min(results, key=lambda result: result[0])
+
+
+def kbd_files():
+  """Names of the kbd layouts shipped next to this module."""
+  return sorted(os.path.basename(path) for path in glob.glob(
+      os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.kbd')))
+
+
+def describe(evaluator, candidate):
+  """The letter block rows of a candidate, as text."""
+  by_position = {}
+  for symbol, position in zip(evaluator.corpus.symbols, candidate):
+    name = symbol.replace('KEY_', '')
+    by_position[position] = name if len(name) == 1 else '*'
+  lines = []
+  for row in (range(16, 28), range(30, 41), range(44, 54)):
+    lines.append(' '.join(by_position.get(evaluator.index[code], '.')
+                          for code in row))
+  return '\n'.join(lines)
+
+
+def main(argv):
+  parser = optparse.OptionParser('Usage: %prog [Options...] recording...')
+  parser.add_option('--typed_on', default='us.kbd',
+                    help='Layout the recordings were typed on.')
+  parser.add_option('--search', action='store_true', default=False,
+                    help='Search for a better letter block.')
+  parser.add_option('--processes', type='int', default=None,
+                    help='Search processes, default one per core.')
+  opts, fnames = parser.parse_args(argv[1:])
+  symbols = sorted(layout_codes(opts.typed_on))
+  corpus = Corpus(symbols)
+  for fname in fnames:
+    corpus.add(event_array.load(fname))
+  evaluator = Evaluator(corpus, opts.typed_on)
+  for kbd_file in kbd_files():
+    score = evaluator.score(evaluator.layout(kbd_file))
+    print '%-12s %8.2fs' % (kbd_file, score)
+  if opts.search:
+    start = evaluator.layout(opts.typed_on)
+    score, best = search(evaluator, start, opts.processes)
+    print 'Best found: %.2fs' % score
+    print describe(evaluator, best)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
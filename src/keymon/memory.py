@@ -0,0 +1,178 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Watch the memory of a long running capture.
+
+A MemoryMonitor samples the resident set size and the events queued in the
+event source, and appends them as a JSON line to a stats file, so a week
+long capture leaves a time series behind. With tracemalloc (Python 3, or the
+pytracemalloc backport) each sample also lists the lines that allocated the
+most. With count_objects it also counts the XEvents alive, and without
+tracemalloc lists the types with the most live objects gc knows of; both
+walk every object, so they are off by default. Crossing a high-water mark
+logs a warning once, until the value drops below it again.
+
+  python memory.py stats-file    # print the samples as a table
+"""
+
+import collections
+import gc
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+from events import XEvent
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+TOP_ALLOCATIONS = 10
+
+
+def rss_bytes():
+  """Resident set size of this process, peak size where /proc is missing."""
+  try:
+    fin = open('/proc/self/statm')
+    try:
+      return int(fin.read().split()[1]) * resource.getpagesize()
+    finally:
+      fin.close()
+  except (IOError, IndexError, ValueError):
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def count_types():
+  """Number of live objects gc tracks, by type.
+  Returns:
+    collections.Counter type -> count
+  """
+  return collections.Counter(type(obj) for obj in gc.get_objects())
+
+
+def count_events():
+  """Number of XEvents alive, queued or not."""
+  return sum(1 for obj in gc.get_objects() if type(obj) is XEvent)
+
+
+class MemoryMonitor(object):
+  """Samples memory and queue sizes into a stats file.
+  Args:
+    devices: the sources.EventSource whose queue to watch.
+    path: stats file, a JSON object per line is appended to it.
+    rss_alarm: RSS in bytes to warn at, 0 for never.
+    queue_alarm: queued events to warn at, 0 for never.
+    count_objects: also count the live XEvents and, without tracemalloc,
+        the live objects by type. Walks all gc objects.
+  """
+
+  def __init__(self, devices, path, rss_alarm=0, queue_alarm=0,
+               count_objects=False):
+    self.devices = devices
+    self.path = path
+    self.alarms = {'rss': rss_alarm, 'queued': queue_alarm}
+    self.count_objects = count_objects
+    self._alarmed = set()
+    self.samples = 0
+    if tracemalloc is not None and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  def sample(self):
+    """Take a sample, write it out and check the alarms.
+    Returns:
+      the sample, a dict.
+    """
+    sample = {
+        'time': time.time(),
+        'rss': rss_bytes(),
+        'queued': self.devices.queued(),
+    }
+    if tracemalloc is not None:
+      if self.count_objects:
+        sample['events'] = count_events()
+      stats = tracemalloc.take_snapshot().statistics('lineno')
+      sample['top'] = [[str(stat.traceback), stat.size, stat.count]
+                       for stat in stats[:TOP_ALLOCATIONS]]
+    elif self.count_objects:
+      types = count_types()
+      sample['events'] = types[XEvent]
+      sample['types'] = [[atype.__name__, count] for atype, count in
+                         types.most_common(TOP_ALLOCATIONS)]
+    fout = open(self.path, 'a')
+    try:
+      fout.write(json.dumps(sample, sort_keys=True) + '\n')
+    finally:
+      fout.close()
+    self.samples += 1
+    self._check(sample)
+    return sample
+
+  def _check(self, sample):
+    for name, limit in self.alarms.items():
+      if not limit:
+        continue
+      if sample[name] >= limit and name not in self._alarmed:
+        self._alarmed.add(name)
+        logging.warning('%s is %d, over the high-water mark of %d',
+                        name, sample[name], limit)
+      elif sample[name] < limit:
+        self._alarmed.discard(name)
+
+  def on_timer(self):
+    """Take a sample, as a gobject timeout callback."""
+    try:
+      self.sample()
+    except (IOError, OSError) as err:
+      logging.error('Memory sample failed: %s', err)
+    return True  # continue calling
+
+
+def read_samples(path):
+  """Read the samples of a stats file, skipping a torn last line."""
+  samples = []
+  for line in open(path):
+    try:
+      samples.append(json.loads(line))
+    except ValueError:
+      pass
+  return samples
+
+
+def main(argv):
+  for path in argv[1:]:
+    samples = read_samples(path)
+    print '%s: %d samples' % (path, len(samples))
+    print '%-19s %10s %10s %10s' % ('time', 'rss MB', 'queued', 'events')
+    for sample in samples:
+      print '%-19s %10.1f %10d %10s' % (
+          time.strftime('%Y-%m-%d %H:%M:%S',
+                        time.localtime(sample['time'])),
+          sample['rss'] / 1048576.0, sample['queued'],
+          sample.get('events', '-'))
+    if samples:
+      print 'peak rss: %.1f MB, peak queue: %d' % (
+          max(sample['rss'] for sample in samples) / 1048576.0,
+          max(sample['queued'] for sample in samples))
+      if 'types' in samples[-1]:
+        print 'most objects, last sample:'
+        for name, count in samples[-1]['types']:
+          print '  %-30s %10d' % (name, count)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
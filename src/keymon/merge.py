@@ -0,0 +1,119 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Merge several recordings into one time ordered stream.
+
+Inputs are streamed, the merge holds one pending event per input. The
+output is a recording. A #source line names each input once, before its first
+event. Window ids are renumbered so those of different inputs don't collide,
+and the #window lines of text inputs are passed through under the new ids:
+
+  python merge.py [--offsets=0,-0.25] a b.npy > merged
+"""
+
+import heapq
+import optparse
+import sys
+
+import motion_codec
+import recording
+
+
+def open_reader(fname):
+  """Events of a text recording, a binary one ending in .npy, or a motion
+  stream ending in .mov."""
+  if fname.endswith('.mov'):
+    return motion_codec.read_events(fname)
+  if fname.endswith('.npy'):
+    import event_array  # NumPy is only needed for binary recordings.
+    arr, remap = event_array.open_binary(fname)
+    return event_array.iter_events(arr, remap)
+  return recording.read_with_motion(fname)
+
+
+def read_input_windows(fname):
+  """Window descriptions of an input, see recording.read_windows(). Only
+  text recordings have them."""
+  if fname.endswith('.mov') or fname.endswith('.npy'):
+    return {}
+  fin = open(fname)
+  try:
+    return recording.read_windows(fin)
+  finally:
+    fin.close()
+
+
+def merge(readers, tags=None, offsets=None):
+  """Merge event streams by timestamp.
+  Args:
+    readers: iterables of (timestamp, type, key id, value), each in time
+        order.
+    tags: tag of each reader, default its index.
+    offsets: seconds added to the timestamps of each reader, to correct
+        clocks that are off.
+  Yields:
+    (timestamp, tag, type, key id, value). Equal timestamps come in the
+    order of readers, and in their own order within a reader.
+  """
+  if tags is None:
+    tags = range(len(readers))
+  if offsets is None:
+    offsets = [0.0] * len(readers)
+  heap = []
+  iters = [iter(reader) for reader in readers]
+  for idx, events in enumerate(iters):
+    for event in events:
+      heap.append((event[0] + offsets[idx], idx, event))
+      break
+  heapq.heapify(heap)
+  while heap:
+    timestamp, idx, event = heap[0]
+    yield (timestamp, tags[idx]) + event[1:]
+    for event in iters[idx]:
+      heapq.heapreplace(heap, (event[0] + offsets[idx], idx, event))
+      break
+    else:
+      heapq.heappop(heap)
+
+
+def main(argv):
+  parser = optparse.OptionParser('Usage: %prog [Options...] recording...')
+  parser.add_option('--offsets', default=None,
+                    help='Comma separated seconds to add to the timestamps '
+                         'of each recording.')
+  opts, fnames = parser.parse_args(argv[1:])
+  offsets = None
+  if opts.offsets:
+    offsets = [float(offset) for offset in opts.offsets.split(',')]
+  readers = [open_reader(fname) for fname in fnames]
+  windows = [read_input_windows(fname) for fname in fnames]
+  started = set()
+  merged_ids = {}  # (input index, window id) -> window id in the output
+  for timestamp, idx, atype, code, value in merge(readers, offsets=offsets):
+    if idx not in started:
+      started.add(idx)
+      sys.stdout.write(recording.format_source(fnames[idx]))
+    if atype == 'EV_WIN' and value:
+      if (idx, value) not in merged_ids:
+        merged_ids[idx, value] = len(merged_ids) + 1
+        if value in windows[idx]:
+          wm_class, title = windows[idx][value]
+          sys.stdout.write(recording.format_window(merged_ids[idx, value],
+                                                   wm_class, title))
+      value = merged_ids[idx, value]
+    sys.stdout.write(recording.format_fields(timestamp, atype, code, value))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
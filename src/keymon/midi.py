@@ -0,0 +1,194 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Play recordings as music: export key presses as Standard MIDI Files.
+
+Each key becomes the note 24 + its scancode in a kbd layout, so physically
+close keys sound close, and presses and releases become note on and off.
+Mouse buttons go to the drum channel. Time is kept to the millisecond.
+
+  python midi.py [--kbd=us.kbd] [--processes=N] recording...
+
+writes recording.mid next to each recording.
+"""
+
+import multiprocessing
+import optparse
+import os
+import struct
+import sys
+
+import key_ids
+import mod_mapper
+import recording
+
+# One tick is a millisecond: 1000 ticks per quarter note of 1000000us.
+DIVISION = 1000
+TEMPO = 1000000
+BASE_NOTE = 24
+VELOCITY = 100
+KEY_CHANNEL = 0
+DRUM_CHANNEL = 9
+BUTTON_NOTES = {'BTN_LEFT': 36, 'BTN_RIGHT': 38, 'BTN_MIDDLE': 42}
+# Longest delta time an SMF event can have, 4 bytes of variable length
+# quantity. Longer gaps, about 74 hours of ticks, are split with FILLER.
+MAX_DELTA = 0x0fffffff
+FILLER = '\xff\x01\x00'  # an empty text meta event
+
+
+def note_map(kbd_file):
+  """Return {key id: (channel, note)} for the keys of a kbd layout."""
+  notes = {}
+  layout = mod_mapper.read_kdb(kbd_file)
+  for scancode in layout:
+    note = BASE_NOTE + scancode
+    if note <= 127:
+      notes[layout.key_id(scancode)] = (KEY_CHANNEL, note)
+  for name, note in BUTTON_NOTES.items():
+    notes[key_ids.key_id(name)] = (DRUM_CHANNEL, note)
+  return notes
+
+
+def _varlen(value):
+  """MIDI variable length quantity."""
+  out = [value & 0x7f]
+  value >>= 7
+  while value:
+    out.append((value & 0x7f) | 0x80)
+    value >>= 7
+  return ''.join(chr(byte) for byte in reversed(out))
+
+
+class MidiWriter(object):
+  """Streams note events into a single track MIDI file.
+
+  The track length is patched in by close(), so fout must be seekable, but
+  nothing but the current time and the notes held down is kept in memory.
+  """
+
+  def __init__(self, fout):
+    self.fout = fout
+    self.fout.write(struct.pack('>4sLHHH', 'MThd', 6, 0, 1, DIVISION))
+    self._length_pos = self.fout.tell() + 4
+    self.fout.write(struct.pack('>4sL', 'MTrk', 0))
+    self._length = 0
+    self._tick = 0
+    self._write(0, '\xff\x51\x03' + struct.pack('>L', TEMPO)[1:])
+
+  def _write(self, tick, data):
+    delta = max(0, tick - self._tick)
+    while delta > MAX_DELTA:
+      self._emit(_varlen(MAX_DELTA) + FILLER)
+      delta -= MAX_DELTA
+    self._emit(_varlen(delta) + data)
+    self._tick = max(self._tick, tick)
+
+  def _emit(self, data):
+    self.fout.write(data)
+    self._length += len(data)
+
+  def note(self, tick, channel, note, on):
+    """Start or stop a note."""
+    if on:
+      self._write(tick, struct.pack('BBB', 0x90 | channel, note, VELOCITY))
+    else:
+      self._write(tick, struct.pack('BBB', 0x80 | channel, note, 0))
+
+  def close(self):
+    """End the track and patch its length in."""
+    self._write(self._tick, '\xff\x2f\x00')
+    self.fout.seek(self._length_pos)
+    self.fout.write(struct.pack('>L', self._length))
+    self.fout.close()
+
+
+def export(events, fout, notes):
+  """Write parsed recording events to a MIDI file.
+  Args:
+    events: iterable of (timestamp, type, key id, value).
+    fout: seekable file to write to.
+    notes: {key id: (channel, note)}, see note_map().
+  Returns:
+    number of notes played
+  """
+  writer = MidiWriter(fout)
+  start = None
+  down = {}  # (channel, note) -> True while sounding
+  played = 0
+  tick = 0
+  for timestamp, atype, code, value in events:
+    if atype != 'EV_KEY' or code not in notes or value not in (0, 1):
+      continue
+    if start is None:
+      start = timestamp
+    tick = int(round((timestamp - start) * 1000))
+    channel, note = notes[code]
+    if value:
+      if (channel, note) in down:
+        writer.note(tick, channel, note, False)
+      down[channel, note] = True
+      writer.note(tick, channel, note, True)
+      played += 1
+    elif down.pop((channel, note), False):
+      writer.note(tick, channel, note, False)
+  for channel, note in down:
+    writer.note(tick, channel, note, False)
+  writer.close()
+  return played
+
+
+def convert(args):
+  """Convert one recording into recording.mid.
+  Args:
+    args: (recording file name, kbd file name)
+  Returns:
+    (MIDI file name, notes played)
+  """
+  fname, kbd_file = args
+  out = os.path.splitext(fname)[0] + '.mid'
+  fin = open(fname)
+  try:
+    played = export(recording.read_events(fin), open(out, 'wb'),
+                    note_map(kbd_file))
+  finally:
+    fin.close()
+  return out, played
+
+
+def convert_corpus(fnames, kbd_file='us.kbd', processes=None):
+  """Convert recordings in parallel, see convert()."""
+  tasks = [(fname, kbd_file) for fname in fnames]
+  if processes == 1 or len(tasks) < 2:
+    return map(convert, tasks)
+  pool = multiprocessing.Pool(processes)
+  try:
+    return pool.map(convert, tasks)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def main(argv):
+  parser = optparse.OptionParser('Usage: %prog [Options...] recording...')
+  parser.add_option('--kbd', default='us.kbd',
+                    help='Layout the key notes are taken from.')
+  parser.add_option('--processes', type='int', default=None,
+                    help='Worker processes, default one per core.')
+  opts, fnames = parser.parse_args(argv[1:])
+  for out, played in convert_corpus(fnames, opts.kbd, opts.processes):
+    print '%s: %d notes' % (out, played)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -18,11 +18,15 @@
 
 __author__ = 'scott@forusers.com (scottkirkwood)'
 
+import array
 import codecs
 import logging
 import os
 import re
 import subprocess
+import sys
+
+import key_ids
 
 MEDIUM_NAME = {
   'ESCAPE': 'Esc',
@@ -204,56 +208,100 @@ SHORT_NAME = {
 }
 
 class ModMapper(object):
-  """Converts Mod Map codes into names and strings."""
+  """Converts Mod Map codes into names and strings.
+
+  Entries live in dense arrays indexed by scancode. The key name is stored as
+  its key_ids id, names are only resolved for the tuples handed out.
+  """
   def __init__(self):
-    self.map = {}
-    self.alt_map = {}
-    self.name_to_code = {}
+    self.ids = array.array('i')  # scancode -> key id, or -1
+    self._medium = []
+    self._short = []
+    self._count = 0
+    self.id_to_code = {}
 
   def done(self):
-    """done setup, now create alt_map and name_to_code."""
-    for key in self.map:
-      vals = self.map[key]
-      code_name = vals[0]
-      self.alt_map[code_name] = vals
-      self.name_to_code[code_name] = key
+    """done setup, now create id_to_code."""
+    self.id_to_code = {}
+    for code, key in enumerate(self.ids):
+      if key >= 0:
+        self.id_to_code[key] = code
 
   def set_map(self, code, vals):
-    """Set one code."""
-    self.map[code] = vals
+    """Set one code.
+    Args:
+      code: the scancode
+      vals: (key name, medium name[, short name])
+    """
+    if code < 0:
+      return
+    if code >= len(self.ids):
+      grow = code + 1 - len(self.ids)
+      self.ids.extend([-1] * grow)
+      self._medium.extend([None] * grow)
+      self._short.extend([None] * grow)
+    if self.ids[code] < 0:
+      self._count += 1
+    self.ids[code] = key_ids.key_id(vals[0])
+    self._medium[code] = vals[1]
+    if len(vals) > 2:
+      self._short[code] = vals[2]
+    else:
+      self._short[code] = None
+
+  def key_id(self, scancode):
+    """Get the key id of a scancode, or -1."""
+    if 0 <= scancode < len(self.ids):
+      return self.ids[scancode]
+    return -1
 
   def get_and_check(self, scancode, name):
     """Get the scan code, or get from name."""
-    if scancode in self.map:
-      vals = self.map[scancode]
-      if vals[0] == name:
-        return vals
+    key = key_ids.find_id(name)
+    if scancode in self:
+      if self.ids[scancode] == key:
+        return self[scancode]
       else:
-        logging.debug('code %s != %s', vals[1], name)
-    if name in self.alt_map:
+        logging.debug('code %s != %s', self._medium[scancode], name)
+    if key in self.id_to_code:
       logging.info('Found key via alt lookup %s', name)
-      return self.alt_map[name]
+      return self[self.id_to_code[key]]
     logging.info('scancode: %r name:%r not found', scancode, name)
     return None, None, None
 
   def get_from_name(self, name):
     """Get the scancode from a name."""
-    if name in self.name_to_code:
-      return self.name_to_code[name], self.alt_map[name]
+    key = key_ids.find_id(name)
+    if key in self.id_to_code:
+      code = self.id_to_code[key]
+      return code, self[code]
     logging.info('Key %s not found', name)
     return None
 
-  def __getitem__(self, key):
-    try:
-      return self.map[key]
-    except:
+  def items(self):
+    """List of (scancode, (key name, medium name, short name))."""
+    return [(code, self[code]) for code in self]
+
+  def __getitem__(self, code):
+    if not code in self:
       raise IndexError
+    return (key_ids.key_name(self.ids[code]), self._medium[code],
+            self._short[code])
+
+  def __setitem__(self, code, vals):
+    self.set_map(code, vals)
+    self.id_to_code.setdefault(self.ids[code], code)
+
+  def __iter__(self):
+    for code, key in enumerate(self.ids):
+      if key >= 0:
+        yield code
 
-  def __contains__(self, key):
-    return key in self.map
+  def __contains__(self, code):
+    return 0 <= code < len(self.ids) and self.ids[code] >= 0
 
   def __len__(self):
-    return len(self.map)
+    return self._count
 
 def parse_modmap(lines):
   """Parse a modmap file."""
@@ -314,7 +362,7 @@ def create_my_kdb(fname, codes):
   fout.write('# This is a space separated file with UTF-8 encoding\n')
   fout.write('# Short name is optional, will default to the medium-name\n')
   fout.write('# Scancode Map-Name Medium-Name Short-Name\n')
-  for code, (key, medium_name, short_name) in codes.map.items():
+  for code, (key, medium_name, short_name) in codes.items():
     if short_name:
       fout.write('%d %s %s %s\n' % (code, key, medium_name, short_name))
     else:
@@ -332,12 +380,58 @@ def run_cmd(args):
   return subprocess.Popen(args, stdout=subprocess.PIPE).communicate()[0]
 
 
-def read_mod_map():
-  """Read a mod_map by runing xmodmap."""
-  logging.debug('Loading keymap from xmodmap...')
-  xmodmap = parse_modmap(run_cmd(mod_map_args()))
+def mod_map_from_keysyms(first_keycode, keysyms, keysym_names):
+  """Build the same mapping parse_modmap() gives, from raw keysyms.
+  Args:
+    first_keycode: X keycode of the first row of keysyms.
+    keysyms: list of keysym rows, as returned by get_keyboard_mapping().
+    keysym_names: dict keysym -> name, as xmodmap would print it.
+  """
+  ret = ModMapper()
+  for idx, row in enumerate(keysyms):
+    row = list(row)
+    # xmodmap stops printing at the last bound entry.
+    while row and not row[-1]:
+      row.pop()
+    names = [keysym_name(keysym, keysym_names) for keysym in row]
+    names = [name for name in names if name]
+    if not names:
+      continue
+    alias = names[0].upper()
+    my_keyname = 'KEY_' + alias
+    my_keyname = my_keyname.replace('XF86', '')
+    ret.set_map(first_keycode + idx - 8, (my_keyname, alias))
+  ret.done()
+  return ret
+
+
+def keysym_name(keysym, keysym_names):
+  """Name a keysym like XKeysymToString(), or None if it has no name."""
+  if not keysym:
+    return 'NoSymbol'
+  if keysym in keysym_names:
+    return keysym_names[keysym]
+  if 0x01000100 <= keysym <= 0x0110FFFF:
+    return 'U%04X' % (keysym & 0xFFFFFF)
+  return None
+
+
+def read_mod_map(devices=None):
+  """Read a mod_map from the X server, or by runing xmodmap.
+  Args:
+    devices: optional sources.EventSource, if it has a keymap, e.g. the X
+        server an xlib.XEvents is connected to, it is used instead of
+        spawning xmodmap.
+  """
+  xmodmap = None
+  if devices:
+    logging.debug('Loading keymap from the event source...')
+    xmodmap = devices.read_mod_map()
+  if xmodmap is None:
+    logging.debug('Loading keymap from xmodmap...')
+    xmodmap = parse_modmap(run_cmd(mod_map_args()))
   ret = ModMapper()
-  for code in xmodmap.map:
+  for code in xmodmap:
     key = xmodmap[code][0]
     key_name = xmodmap[code][1]
     if key_name in MEDIUM_NAME:
@@ -353,11 +447,12 @@ def read_mod_map():
   return ret
 
 
-def safely_read_mod_map(fname, kbd_files):
+def safely_read_mod_map(fname, kbd_files, devices=None):
   """Read the specified mod_map file or get the US version by default.
   Args:
     fname: name of kbd file to read
     kbd_files: list of full path of kbd files
+    devices: optional sources.EventSource to read the keymap from
   """
   # Assigning a default kbdfile name using result of setxkbmap
   DEFAULT_KBD = None
@@ -392,7 +487,7 @@ def safely_read_mod_map(fname, kbd_files):
   ret = None
   if fname == 'xmodmap' or not kbd_default:
     try:
-      ret = read_mod_map()
+      ret = read_mod_map(devices)
     except OSError:
       logging.error('unable execute xmodmap')
 
@@ -410,3 +505,172 @@ def safely_read_mod_map(fname, kbd_files):
   else:
     logging.error('Can not find default kbd file')
   return ret
+
+
+# xmodmap -pk of a us pc105 keymap. Prior, F11, apostrophe, Henkan_Mode and
+# Mode_switch have aliases in the keysym tables, Page_Up, L1, quoteright,
+# Henkan and script_switch, that xmodmap does not print.
+_SAMPLE_XMODMAP = """There are 7 KeySyms per KeyCode; KeyCodes range from 8 to 255.
+
+    KeyCode\tKeysym (Keysym)\t...
+    Value  \tValue   (Name)  \t...
+
+      8    
+      9    \t0xff1b (Escape)\t0x0000 (NoSymbol)\t0xff1b (Escape)
+     10    \t0x0031 (1)\t0x0021 (exclam)\t0x0031 (1)\t0x0021 (exclam)
+     11    \t0x0032 (2)\t0x0040 (at)\t0x0032 (2)\t0x0040 (at)
+     12    \t0x0033 (3)\t0x0023 (numbersign)\t0x0033 (3)\t0x0023 (numbersign)
+     13    \t0x0034 (4)\t0x0024 (dollar)\t0x0034 (4)\t0x0024 (dollar)
+     14    \t0x0035 (5)\t0x0025 (percent)\t0x0035 (5)\t0x0025 (percent)
+     15    \t0x0036 (6)\t0x005e (asciicircum)\t0x0036 (6)\t0x005e (asciicircum)
+     16    \t0x0037 (7)\t0x0026 (ampersand)\t0x0037 (7)\t0x0026 (ampersand)
+     17    \t0x0038 (8)\t0x002a (asterisk)\t0x0038 (8)\t0x002a (asterisk)
+     18    \t0x0039 (9)\t0x0028 (parenleft)\t0x0039 (9)\t0x0028 (parenleft)
+     19    \t0x0030 (0)\t0x0029 (parenright)\t0x0030 (0)\t0x0029 (parenright)
+     20    \t0x002d (minus)\t0x005f (underscore)\t0x002d (minus)\t0x005f (underscore)
+     21    \t0x003d (equal)\t0x002b (plus)\t0x003d (equal)\t0x002b (plus)
+     22    \t0xff08 (BackSpace)\t0xff08 (BackSpace)\t0xff08 (BackSpace)\t0xff08 (BackSpace)
+     23    \t0xff09 (Tab)\t0xfe20 (ISO_Left_Tab)\t0xff09 (Tab)\t0xfe20 (ISO_Left_Tab)
+     24    \t0x0071 (q)\t0x0051 (Q)\t0x0071 (q)\t0x0051 (Q)
+     25    \t0x0077 (w)\t0x0057 (W)\t0x0077 (w)\t0x0057 (W)
+     26    \t0x0065 (e)\t0x0045 (E)\t0x0065 (e)\t0x0045 (E)
+     27    \t0x0072 (r)\t0x0052 (R)\t0x0072 (r)\t0x0052 (R)
+     28    \t0x0074 (t)\t0x0054 (T)\t0x0074 (t)\t0x0054 (T)
+     29    \t0x0079 (y)\t0x0059 (Y)\t0x0079 (y)\t0x0059 (Y)
+     30    \t0x0075 (u)\t0x0055 (U)\t0x0075 (u)\t0x0055 (U)
+     31    \t0x0069 (i)\t0x0049 (I)\t0x0069 (i)\t0x0049 (I)
+     32    \t0x006f (o)\t0x004f (O)\t0x006f (o)\t0x004f (O)
+     33    \t0x0070 (p)\t0x0050 (P)\t0x0070 (p)\t0x0050 (P)
+     34    \t0x005b (bracketleft)\t0x007b (braceleft)\t0x005b (bracketleft)\t0x007b (braceleft)
+     35    \t0x005d (bracketright)\t0x007d (braceright)\t0x005d (bracketright)\t0x007d (braceright)
+     36    \t0xff0d (Return)\t0x0000 (NoSymbol)\t0xff0d (Return)
+     37    \t0xffe3 (Control_L)\t0x0000 (NoSymbol)\t0xffe3 (Control_L)
+     38    \t0x0061 (a)\t0x0041 (A)\t0x0061 (a)\t0x0041 (A)
+     39    \t0x0073 (s)\t0x0053 (S)\t0x0073 (s)\t0x0053 (S)
+     40    \t0x0064 (d)\t0x0044 (D)\t0x0064 (d)\t0x0044 (D)
+     41    \t0x0066 (f)\t0x0046 (F)\t0x0066 (f)\t0x0046 (F)
+     42    \t0x0067 (g)\t0x0047 (G)\t0x0067 (g)\t0x0047 (G)
+     43    \t0x0068 (h)\t0x0048 (H)\t0x0068 (h)\t0x0048 (H)
+     44    \t0x006a (j)\t0x004a (J)\t0x006a (j)\t0x004a (J)
+     45    \t0x006b (k)\t0x004b (K)\t0x006b (k)\t0x004b (K)
+     46    \t0x006c (l)\t0x004c (L)\t0x006c (l)\t0x004c (L)
+     47    \t0x003b (semicolon)\t0x003a (colon)\t0x003b (semicolon)\t0x003a (colon)
+     48    \t0x0027 (apostrophe)\t0x0022 (quotedbl)\t0x0027 (apostrophe)\t0x0022 (quotedbl)
+     49    \t0x0060 (grave)\t0x007e (asciitilde)\t0x0060 (grave)\t0x007e (asciitilde)
+     50    \t0xffe1 (Shift_L)\t0x0000 (NoSymbol)\t0xffe1 (Shift_L)
+     51    \t0x005c (backslash)\t0x007c (bar)\t0x005c (backslash)\t0x007c (bar)
+     52    \t0x007a (z)\t0x005a (Z)\t0x007a (z)\t0x005a (Z)
+     53    \t0x0078 (x)\t0x0058 (X)\t0x0078 (x)\t0x0058 (X)
+     54    \t0x0063 (c)\t0x0043 (C)\t0x0063 (c)\t0x0043 (C)
+     55    \t0x0076 (v)\t0x0056 (V)\t0x0076 (v)\t0x0056 (V)
+     56    \t0x0062 (b)\t0x0042 (B)\t0x0062 (b)\t0x0042 (B)
+     57    \t0x006e (n)\t0x004e (N)\t0x006e (n)\t0x004e (N)
+     58    \t0x006d (m)\t0x004d (M)\t0x006d (m)\t0x004d (M)
+     59    \t0x002c (comma)\t0x003c (less)\t0x002c (comma)\t0x003c (less)
+     60    \t0x002e (period)\t0x003e (greater)\t0x002e (period)\t0x003e (greater)
+     61    \t0x002f (slash)\t0x003f (question)\t0x002f (slash)\t0x003f (question)
+     62    \t0xffe2 (Shift_R)\t0x0000 (NoSymbol)\t0xffe2 (Shift_R)
+     63    \t0xffaa (KP_Multiply)\t0xffaa (KP_Multiply)\t0xffaa (KP_Multiply)\t0xffaa (KP_Multiply)
+     64    \t0xffe9 (Alt_L)\t0xffe7 (Meta_L)\t0xffe9 (Alt_L)\t0xffe7 (Meta_L)
+     65    \t0x0020 (space)\t0x0000 (NoSymbol)\t0x0020 (space)
+     66    \t0xffe5 (Caps_Lock)\t0x0000 (NoSymbol)\t0xffe5 (Caps_Lock)
+     67    \t0xffbe (F1)\t0xffbe (F1)\t0xffbe (F1)\t0xffbe (F1)
+     68    \t0xffbf (F2)\t0xffbf (F2)\t0xffbf (F2)\t0xffbf (F2)
+     69    \t0xffc0 (F3)\t0xffc0 (F3)\t0xffc0 (F3)\t0xffc0 (F3)
+     70    \t0xffc1 (F4)\t0xffc1 (F4)\t0xffc1 (F4)\t0xffc1 (F4)
+     71    \t0xffc2 (F5)\t0xffc2 (F5)\t0xffc2 (F5)\t0xffc2 (F5)
+     72    \t0xffc3 (F6)\t0xffc3 (F6)\t0xffc3 (F6)\t0xffc3 (F6)
+     73    \t0xffc4 (F7)\t0xffc4 (F7)\t0xffc4 (F7)\t0xffc4 (F7)
+     74    \t0xffc5 (F8)\t0xffc5 (F8)\t0xffc5 (F8)\t0xffc5 (F8)
+     75    \t0xffc6 (F9)\t0xffc6 (F9)\t0xffc6 (F9)\t0xffc6 (F9)
+     76    \t0xffc7 (F10)\t0xffc7 (F10)\t0xffc7 (F10)\t0xffc7 (F10)
+     77    \t0xff7f (Num_Lock)\t0x0000 (NoSymbol)\t0xff7f (Num_Lock)
+     78    \t0xff14 (Scroll_Lock)\t0x0000 (NoSymbol)\t0xff14 (Scroll_Lock)
+     79    \t0xff95 (KP_Home)\t0xffb7 (KP_7)\t0xff95 (KP_Home)\t0xffb7 (KP_7)
+     80    \t0xff97 (KP_Up)\t0xffb8 (KP_8)\t0xff97 (KP_Up)\t0xffb8 (KP_8)
+     81    \t0xff9a (KP_Prior)\t0xffb9 (KP_9)\t0xff9a (KP_Prior)\t0xffb9 (KP_9)
+     82    \t0xffad (KP_Subtract)\t0xffad (KP_Subtract)\t0xffad (KP_Subtract)\t0xffad (KP_Subtract)
+     83    \t0xff96 (KP_Left)\t0xffb4 (KP_4)\t0xff96 (KP_Left)\t0xffb4 (KP_4)
+     84    \t0xff9d (KP_Begin)\t0xffb5 (KP_5)\t0xff9d (KP_Begin)\t0xffb5 (KP_5)
+     85    \t0xff98 (KP_Right)\t0xffb6 (KP_6)\t0xff98 (KP_Right)\t0xffb6 (KP_6)
+     86    \t0xffab (KP_Add)\t0xffab (KP_Add)\t0xffab (KP_Add)\t0xffab (KP_Add)
+     87    \t0xff9c (KP_End)\t0xffb1 (KP_1)\t0xff9c (KP_End)\t0xffb1 (KP_1)
+     88    \t0xff99 (KP_Down)\t0xffb2 (KP_2)\t0xff99 (KP_Down)\t0xffb2 (KP_2)
+     89    \t0xff9b (KP_Next)\t0xffb3 (KP_3)\t0xff9b (KP_Next)\t0xffb3 (KP_3)
+     90    \t0xff9e (KP_Insert)\t0xffb0 (KP_0)\t0xff9e (KP_Insert)\t0xffb0 (KP_0)
+     91    \t0xff9f (KP_Delete)\t0xffae (KP_Decimal)\t0xff9f (KP_Delete)\t0xffae (KP_Decimal)
+     92    \t0x0000 (NoSymbol)\t0xfe03 (ISO_Level3_Shift)
+     94    \t0x003c (less)\t0x003e (greater)\t0x003c (less)\t0x003e (greater)\t0x007c (bar)\t0x00a6 (brokenbar)
+     95    \t0xffc8 (F11)\t0xffc8 (F11)\t0xffc8 (F11)\t0xffc8 (F11)
+     96    \t0xffc9 (F12)\t0xffc9 (F12)\t0xffc9 (F12)\t0xffc9 (F12)
+    100    \t0xff23 (Henkan_Mode)\t0x0000 (NoSymbol)\t0xff23 (Henkan_Mode)
+    104    \t0xff8d (KP_Enter)\t0x0000 (NoSymbol)\t0xff8d (KP_Enter)
+    105    \t0xffe4 (Control_R)\t0x0000 (NoSymbol)\t0xffe4 (Control_R)
+    106    \t0xffaf (KP_Divide)\t0xffaf (KP_Divide)\t0xffaf (KP_Divide)\t0xffaf (KP_Divide)
+    107    \t0xff61 (Print)\t0xff15 (Sys_Req)\t0xff61 (Print)\t0xff15 (Sys_Req)
+    108    \t0xffea (Alt_R)\t0xffe8 (Meta_R)\t0xffea (Alt_R)\t0xffe8 (Meta_R)
+    110    \t0xff50 (Home)\t0x0000 (NoSymbol)\t0xff50 (Home)
+    111    \t0xff52 (Up)\t0x0000 (NoSymbol)\t0xff52 (Up)
+    112    \t0xff55 (Prior)\t0x0000 (NoSymbol)\t0xff55 (Prior)
+    113    \t0xff51 (Left)\t0x0000 (NoSymbol)\t0xff51 (Left)
+    114    \t0xff53 (Right)\t0x0000 (NoSymbol)\t0xff53 (Right)
+    115    \t0xff57 (End)\t0x0000 (NoSymbol)\t0xff57 (End)
+    116    \t0xff54 (Down)\t0x0000 (NoSymbol)\t0xff54 (Down)
+    117    \t0xff56 (Next)\t0x0000 (NoSymbol)\t0xff56 (Next)
+    118    \t0xff63 (Insert)\t0x0000 (NoSymbol)\t0xff63 (Insert)
+    119    \t0xffff (Delete)\t0x0000 (NoSymbol)\t0xffff (Delete)
+    121    \t0x1008ff12 (XF86AudioMute)\t0x0000 (NoSymbol)\t0x1008ff12 (XF86AudioMute)
+    122    \t0x1008ff11 (XF86AudioLowerVolume)\t0x0000 (NoSymbol)\t0x1008ff11 (XF86AudioLowerVolume)
+    123    \t0x1008ff13 (XF86AudioRaiseVolume)\t0x0000 (NoSymbol)\t0x1008ff13 (XF86AudioRaiseVolume)
+    127    \t0xff13 (Pause)\t0xff6b (Break)\t0xff13 (Pause)\t0xff6b (Break)
+    133    \t0xffeb (Super_L)\t0x0000 (NoSymbol)\t0xffeb (Super_L)
+    134    \t0xffec (Super_R)\t0x0000 (NoSymbol)\t0xffec (Super_R)
+    135    \t0xff67 (Menu)\t0x0000 (NoSymbol)\t0xff67 (Menu)
+    153    \t0x10020ac (U20AC)
+    203    \t0xff7e (Mode_switch)\t0x0000 (NoSymbol)\t0xff7e (Mode_switch)
+"""
+
+
+def _sample_keysyms(text, first_keycode=8, last_keycode=255):
+  """The keysym rows of xmodmap -pk output, as get_keyboard_mapping() gives
+  them: one row per keycode, all of the same length."""
+  re_line = re.compile(r'^\s+(\d+)\s*(.*)')
+  by_keycode = {}
+  for line in text.split('\n'):
+    grps = re_line.search(line)
+    if grps:
+      by_keycode[int(grps.group(1))] = [
+          int(value, 16) for value in re.findall(r'0x([\dA-Fa-f]+)',
+                                                 grps.group(2))]
+  width = max(len(row) for row in by_keycode.values())
+  rows = []
+  for keycode in range(first_keycode, last_keycode + 1):
+    row = by_keycode.get(keycode, [])
+    rows.append(row + [0] * (width - len(row)))
+  return rows
+
+
+def _run_test():
+  """Check the native keymap reader against canned xmodmap output.
+
+  The text goes through parse_modmap(), its keysyms through
+  mod_map_from_keysyms() with the names of xlib.keysym_names(), and the two
+  whole maps have to match.
+  """
+  import xlib
+  from_text = parse_modmap(_SAMPLE_XMODMAP)
+  from_keysyms = mod_map_from_keysyms(8, _sample_keysyms(_SAMPLE_XMODMAP),
+                                      xlib.keysym_names())
+  if from_text.items() != from_keysyms.items():
+    text_items = dict(from_text.items())
+    keysym_items = dict(from_keysyms.items())
+    for code in sorted(set(text_items) | set(keysym_items)):
+      if text_items.get(code) != keysym_items.get(code):
+        print 'Mismatch at %d:\n  xmodmap: %r\n  native:  %r' % (
+            code, text_items.get(code), keysym_items.get(code))
+    sys.exit(1)
+  print 'OK, %d keys match' % len(from_text)
+
+
+if __name__ == '__main__':
+  _run_test()
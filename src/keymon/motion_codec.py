@@ -0,0 +1,285 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact encoding of mouse motion streams.
+
+Motion is stored in blocks of up to BLOCK_SIZE events:
+
+  varint  payload bytes
+  varint  event count
+  payload zigzag varints: t, x, y of the first event (the keyframe), then
+          dt, dx, dy of every other event from the one before it
+
+Times are in microseconds. Each block starts from absolute values, so a
+reader can skip to any block from the headers alone. A block is written out
+once it is full or spans BLOCK_SECONDS, whichever comes first. Encoding is
+plain Python cheap enough to run in the log writer; decoding uses NumPy when
+available, turning a whole file into arrays without a Python loop per event.
+NumPy is only imported by the first decode, so the readers of text
+recordings that import this module don't pay for it.
+
+KeyMon --motion_codec writes the motion of a recording into recording +
+'.mov', and recording.read_recording() merges it back in.
+"""
+
+import array
+import time
+
+import key_ids
+
+_NO_NUMPY = object()
+_numpy = None  # the numpy module, or _NO_NUMPY, once decode() looked
+
+BLOCK_SIZE = 256
+# Most seconds of motion a block holds before it is written out.
+BLOCK_SECONDS = 1.0
+# Bytes read_blocks() reads at a time.
+READ_SIZE = 65536
+
+
+def zigzag(value):
+  """Map signed to unsigned ints, small magnitudes to small values."""
+  if value < 0:
+    return (-value << 1) - 1
+  return value << 1
+
+
+def unzigzag(value):
+  return (value >> 1) ^ -(value & 1)
+
+
+def write_varint(out, value):
+  """Append an unsigned int to a bytearray, 7 bits per byte."""
+  while value > 0x7f:
+    out.append((value & 0x7f) | 0x80)
+    value >>= 7
+  out.append(value)
+
+
+def read_varint(data, pos):
+  """Returns (value, position after it)."""
+  value = 0
+  shift = 0
+  while True:
+    byte = data[pos]
+    pos += 1
+    value |= (byte & 0x7f) << shift
+    if byte < 0x80:
+      return value, pos
+    shift += 7
+
+
+class MotionEncoder(object):
+  """Writes (timestamp, x, y) motion events into a file in blocks.
+
+  Blocks are written when full or once their first event is block_seconds
+  old, by add() or, if the motion stops, by on_timer().
+  """
+
+  def __init__(self, fout, block_size=BLOCK_SIZE,
+               block_seconds=BLOCK_SECONDS):
+    self.fout = fout
+    self.block_size = block_size
+    self.block_seconds = block_seconds
+    self._block = bytearray()
+    self._count = 0
+    self._first = None  # timestamp of the first event of the block
+    self._last = None
+
+  def add(self, timestamp, x, y):
+    """Encode one motion event."""
+    usec = int(round(timestamp * 1e6))
+    block = self._block
+    if self._last is None:
+      self._first = timestamp
+      write_varint(block, zigzag(usec))
+      write_varint(block, zigzag(x))
+      write_varint(block, zigzag(y))
+    else:
+      last_usec, last_x, last_y = self._last
+      write_varint(block, zigzag(usec - last_usec))
+      write_varint(block, zigzag(x - last_x))
+      write_varint(block, zigzag(y - last_y))
+    self._last = (usec, x, y)
+    self._count += 1
+    if (self._count == self.block_size or
+        timestamp - self._first >= self.block_seconds):
+      self.flush()
+
+  def on_timer(self):
+    """Write out a block that is block_seconds old, as a gobject timeout
+    callback."""
+    if self._count and time.time() - self._first >= self.block_seconds:
+      self.flush()
+    return True  # continue calling
+
+  def flush(self):
+    """Write out the current block, even if it is not full."""
+    if not self._count:
+      return
+    header = bytearray()
+    write_varint(header, len(self._block))
+    write_varint(header, self._count)
+    self.fout.write(bytes(header + self._block))
+    self.fout.flush()
+    self._block = bytearray()
+    self._count = 0
+    self._first = None
+    self._last = None
+
+  def close(self):
+    self.flush()
+    self.fout.close()
+
+
+def read_index(data):
+  """Walk the block headers.
+  Returns:
+    list of (payload offset, payload bytes, event count)
+  """
+  data = bytearray(data)
+  blocks = []
+  pos = 0
+  while pos < len(data):
+    try:
+      size, pos = read_varint(data, pos)
+      count, pos = read_varint(data, pos)
+    except IndexError:
+      break  # a header still being written
+    if pos + size > len(data):
+      break  # a block still being written
+    blocks.append((pos, size, count))
+    pos += size
+  return blocks
+
+
+def _decode_python(data, blocks):
+  times, xs, ys = array.array('d'), array.array('i'), array.array('i')
+  for pos, unused_size, count in blocks:
+    usec = x = y = 0
+    for unused_i in xrange(count):
+      value, pos = read_varint(data, pos)
+      usec += unzigzag(value)
+      value, pos = read_varint(data, pos)
+      x += unzigzag(value)
+      value, pos = read_varint(data, pos)
+      y += unzigzag(value)
+      times.append(usec / 1e6)
+      xs.append(x)
+      ys.append(y)
+  return times, xs, ys
+
+
+def _import_numpy():
+  """The numpy module, or None if it is not installed."""
+  global _numpy
+  if _numpy is None:
+    try:
+      import numpy
+      _numpy = numpy
+    except ImportError:
+      _numpy = _NO_NUMPY
+  if _numpy is _NO_NUMPY:
+    return None
+  return _numpy
+
+
+def _decode_numpy(np, data, blocks):
+  raw = np.frombuffer(bytes(data), dtype=np.uint8)
+  payload = np.concatenate([raw[pos:pos + size] for pos, size, _ in blocks])
+  # Split the bytes into varints, and shift each byte by 7 * its position.
+  ends = np.flatnonzero(payload < 0x80)
+  starts = np.concatenate(([0], ends[:-1] + 1))
+  position = np.arange(len(payload)) - np.repeat(starts, ends - starts + 1)
+  parts = (payload & 0x7f).astype(np.uint64) << (7 * position).astype(
+      np.uint64)
+  values = np.add.reduceat(parts, starts).astype(np.int64)
+  values = (values >> 1) ^ -(values & 1)
+  triples = values.reshape(-1, 3)
+  # Deltas sum up from the keyframe of their block.
+  counts = np.array([count for _, _, count in blocks])
+  firsts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+  totals = np.cumsum(triples, axis=0)
+  totals -= np.repeat(totals[firsts] - triples[firsts], counts, axis=0)
+  return totals[:, 0] / 1e6, totals[:, 1], totals[:, 2]
+
+
+def decode(data, blocks=None):
+  """Decode an encoded motion stream.
+  Args:
+    data: the encoded stream.
+    blocks: only decode these blocks of read_index(data).
+  Returns:
+    (timestamps, xs, ys) arrays
+  """
+  if blocks is None:
+    blocks = read_index(data)
+  if not blocks:
+    return [], [], []
+  np = _import_numpy()
+  if np is not None:
+    return _decode_numpy(np, data, blocks)
+  return _decode_python(bytearray(data), blocks)
+
+
+def read_motion(fname):
+  """Decode a motion file, see decode()."""
+  fin = open(fname, 'rb')
+  try:
+    return decode(fin.read())
+  finally:
+    fin.close()
+
+
+def read_blocks(fin, read_size=READ_SIZE):
+  """Read an open motion file a piece at a time.
+  Yields:
+    (data, blocks), whole blocks and their read_index(data)
+  """
+  data = bytearray()
+  while True:
+    more = fin.read(read_size)
+    data += more
+    blocks = read_index(data)
+    if blocks:
+      end = blocks[-1][0] + blocks[-1][1]
+      yield bytes(data[:end]), blocks
+      del data[:end]
+    if not more:
+      return
+
+
+def read_events(fname):
+  """Yield the motion of a file as (timestamp, 'EV_MOV', 0, (x, y)), so it
+  can be merged back with the rest of its recording. Only about READ_SIZE
+  bytes of the file are in memory at a time."""
+  fin = open(fname, 'rb')
+  try:
+    for data, blocks in read_blocks(fin):
+      times, xs, ys = decode(data, blocks)
+      for timestamp, x, y in zip(times, xs, ys):
+        yield float(timestamp), 'EV_MOV', key_ids.NO_KEY, (int(x), int(y))
+  finally:
+    fin.close()
+
+
+def encode_text(fin, fout, block_size=BLOCK_SIZE):
+  """Encode the EV_MOV lines of a text recording."""
+  encoder = MotionEncoder(fout, block_size)
+  for line in fin:
+    fields = line.split(';')
+    if len(fields) == 4 and fields[1] == 'EV_MOV':
+      x, y = fields[3].strip().strip('()').split(',')
+      encoder.add(float(fields[0]), int(x), int(y))
+  encoder.flush()
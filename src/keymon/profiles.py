@@ -0,0 +1,247 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keystroke dynamics profiles: who typed a recording, from its timing.
+
+A profile is a fixed length vector of log median times: the dwell of common
+keys, the flight between the presses of common digraphs, and percentiles of
+all dwells and flights. Features a session has too few samples of are NaN.
+A ProfileIndex standardizes the stored profiles and finds the nearest ones
+to a query with one vectorized distance computation, or a k-d tree when
+SciPy is installed and the index is large.
+
+  python profiles.py --index=profiles.npz add recording...
+  python profiles.py --index=profiles.npz query recording...
+"""
+
+import optparse
+import os
+import sys
+import warnings
+
+import numpy as np
+
+import event_array
+import recording
+import sessions
+import stats
+
+try:
+  from scipy.spatial import cKDTree
+except ImportError:
+  cKDTree = None
+
+DWELL_KEYS = ['KEY_%s' % letter for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'] + [
+    'KEY_SPACE', 'KEY_SHIFT_L', 'KEY_BACKSPACE', 'KEY_RETURN']
+DIGRAPHS = ('TH HE IN ER AN RE ON AT EN ND TI ES OR TE OF ED IS IT AL AR ST '
+            'TO NT NG SE HA AS OU IO LE').split()
+PERCENTILES = (10, 25, 50, 75, 90)
+FEATURES = (['dwell %s' % name[4:] for name in DWELL_KEYS] +
+            ['flight %s' % digraph for digraph in DIGRAPHS] +
+            ['dwell p%d' % pct for pct in PERCENTILES] +
+            ['flight p%d' % pct for pct in PERCENTILES])
+# Presses further apart than this are not a digraph, in seconds.
+MAX_FLIGHT = 1.0
+# Samples a feature needs, fewer leave it NaN.
+MIN_SAMPLES = 3
+# Indexes at least this large use the k-d tree, if there is one.
+TREE_SIZE = 2048
+
+
+def _median(values):
+  """Log median of values, NaN if too few."""
+  if len(values) < MIN_SAMPLES:
+    return np.nan
+  return np.log(np.median(values))
+
+
+def _medians(values, groups, count):
+  """Log median of values per group 0..count-1, NaN if too few."""
+  order = np.argsort(groups, kind='mergesort')
+  values, groups = values[order], groups[order]
+  bounds = np.searchsorted(groups, np.arange(count + 1))
+  return np.array([_median(values[bounds[idx]:bounds[idx + 1]])
+                   for idx in xrange(count)])
+
+
+def _percentiles(values):
+  if len(values) < MIN_SAMPLES:
+    return np.full(len(PERCENTILES), np.nan)
+  return np.log(np.percentile(values, PERCENTILES))
+
+
+def profile(arr, names):
+  """Profile vector of an event_array, see FEATURES.
+  Args:
+    arr: the events, e.g. a session of a recording.
+    names: key_ids.key_names() of the process that built arr.
+  """
+  keys = arr[arr['type'] == event_array.EV_KEY]
+  dwell_codes = []  # (key id, index in DWELL_KEYS)
+  letter_index = np.full(len(names), -1, dtype=int)
+  for code, name in enumerate(names):
+    if name in DWELL_KEYS:
+      dwell_codes.append((code, DWELL_KEYS.index(name)))
+    if len(name) == 5 and name.startswith('KEY_') and name[4].isalpha():
+      letter_index[code] = ord(name[4]) - ord('A')
+  digraph_index = np.full((26, 26), -1, dtype=int)
+  for idx, digraph in enumerate(DIGRAPHS):
+    digraph_index[ord(digraph[0]) - ord('A'), ord(digraph[1]) - ord('A')] = idx
+
+  # Dwell: press to release of the same key.
+  dwells = stats.dwell_times(keys)
+  dwell = np.full(len(DWELL_KEYS), np.nan)
+  for code, idx in dwell_codes:
+    dwell[idx] = _median(stats.dwell_times(keys[keys['code'] == code]))
+
+  # Flight: press to press of consecutive presses.
+  presses = keys[keys['value'] == 1]
+  presses = presses[np.argsort(presses['time'], kind='mergesort')]
+  flights = np.diff(presses['time'])
+  close = (flights > 0) & (flights < MAX_FLIGHT)
+  firsts = letter_index[presses['code'][:-1]]
+  seconds = letter_index[presses['code'][1:]]
+  digraphs = np.where((firsts >= 0) & (seconds >= 0),
+                      digraph_index[firsts, seconds], -1)
+  known = close & (digraphs >= 0)
+  flight = _medians(flights[known], digraphs[known], len(DIGRAPHS))
+
+  return np.concatenate((dwell, flight, _percentiles(dwells[dwells > 0]),
+                         _percentiles(flights[close])))
+
+
+def recording_profiles(fname, idle=sessions.DEFAULT_IDLE, processes=None):
+  """Profile every session of a recording.
+  Returns:
+    list of (label, vector), labels are user/recording#session, the user
+    taken from the README next to the recording if it has one.
+  """
+  arr = event_array.load(fname)
+  parts = sessions.split(arr, sessions.find_sessions(arr['time'], idle))
+  vectors = sessions.analyze(parts, profile, processes)
+  name = os.path.basename(fname)
+  readme = os.path.join(os.path.dirname(fname), 'README.md')
+  user = None
+  if os.path.exists(readme):
+    user = recording.read_notes(readme).get(name, {}).get('user')
+  return [('%s/%s#%d' % (user or '?', name, idx + 1), vector)
+          for idx, vector in enumerate(vectors)]
+
+
+class ProfileIndex(object):
+  """Stored profiles, searchable by distance between standardized vectors.
+
+  Missing features are filled with the index mean, so they do not count
+  for or against any match.
+  """
+
+  def __init__(self, labels=(), vectors=None):
+    self.labels = list(labels)
+    if vectors is None:
+      vectors = np.zeros((0, len(FEATURES)))
+    self.vectors = np.asarray(vectors, dtype=float).reshape(-1, len(FEATURES))
+    self._points = None
+    self._tree = None
+
+  def __len__(self):
+    return len(self.labels)
+
+  def add(self, label, vector):
+    self.labels.append(label)
+    self.vectors = np.vstack((self.vectors, vector))
+    self._points = None
+
+  def _standardize(self, vectors):
+    return np.nan_to_num((vectors - self._mean) / self._std)
+
+  def _build(self):
+    with warnings.catch_warnings():
+      # Features no profile has are all NaN columns.
+      warnings.simplefilter('ignore', RuntimeWarning)
+      self._mean = np.nan_to_num(np.nanmean(self.vectors, axis=0))
+      std = np.nan_to_num(np.nanstd(self.vectors, axis=0))
+    self._std = np.where(std > 0, std, 1.0)
+    self._points = self._standardize(self.vectors)
+    self._tree = None
+    if cKDTree is not None and len(self) >= TREE_SIZE:
+      self._tree = cKDTree(self._points)
+
+  def query(self, vector, k=5):
+    """Find the stored profiles nearest to a profile vector.
+    Returns:
+      list of up to k (distance, label), nearest first.
+    """
+    if not len(self):
+      return []
+    if self._points is None:
+      self._build()
+    k = min(k, len(self))
+    point = self._standardize(np.asarray(vector, dtype=float))
+    if self._tree is not None:
+      distances, nearest = self._tree.query(point, k)
+      distances, nearest = np.atleast_1d(distances), np.atleast_1d(nearest)
+    else:
+      distances = np.sqrt(((self._points - point) ** 2).sum(axis=1))
+      nearest = np.argpartition(distances, k - 1)[:k]
+      nearest = nearest[np.argsort(distances[nearest])]
+      distances = distances[nearest]
+    return [(float(distance), self.labels[idx])
+            for distance, idx in zip(distances, nearest)]
+
+  def save(self, fname):
+    fout = open(fname, 'wb')
+    try:
+      np.savez(fout, labels=np.array(self.labels), vectors=self.vectors)
+    finally:
+      fout.close()
+
+  @classmethod
+  def load(cls, fname):
+    """Read a saved index, or return an empty one if there is none."""
+    if not os.path.exists(fname):
+      return cls()
+    data = np.load(fname)
+    return cls(data['labels'].tolist(), data['vectors'])
+
+
+def main(argv):
+  parser = optparse.OptionParser(
+      'Usage: %prog [Options...] add|query recording...')
+  parser.add_option('--index', default='profiles.npz',
+                    help='File the profiles are kept in.')
+  parser.add_option('--idle', type='float', default=sessions.DEFAULT_IDLE,
+                    help='Seconds without events that end a session.')
+  parser.add_option('-k', type='int', default=5,
+                    help='Number of matches to show.')
+  parser.add_option('--processes', type='int', default=None,
+                    help='Worker processes, default one per core.')
+  opts, args = parser.parse_args(argv[1:])
+  if len(args) < 2 or args[0] not in ('add', 'query'):
+    parser.error('expected add or query and recordings')
+  index = ProfileIndex.load(opts.index)
+  for fname in args[1:]:
+    for label, vector in recording_profiles(fname, opts.idle, opts.processes):
+      if args[0] == 'add':
+        index.add(label, vector)
+        print 'Added %s' % label
+      else:
+        print '%s:' % label
+        for distance, match in index.query(vector, opts.k):
+          print '  %8.3f %s' % (distance, match)
+  if args[0] == 'add':
+    index.save(opts.index)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
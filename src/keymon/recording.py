@@ -0,0 +1,169 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read and write the text recordings KeyMon logs.
+
+A recording has one event per line:
+
+  1449099006.81379;EV_KEY;KEY_SUPER_L;1
+  1449099017.88767;EV_MOV;0;(600, 1190)
+
+When the focused window is tracked, an EV_WIN line with the window id as its
+value marks each focus change, and every id is described once before its
+first use:
+
+  #window;3;Gvim;main.c + (~/src) - GVIM
+  1449099020.51234;EV_WIN;0;3
+
+Merged recordings name each input once, before its first event:
+
+  #source;laptop/prvak-log-20151202-233006
+
+With KeyMon --motion_codec, the mouse motion goes into a motion_codec file
+next to the recording, motion_path() names it, and read_recording() merges it
+back in.
+
+What was recorded is noted separately, in the README next to the recordings.
+Key names are turned into key_ids ids here, everything past this module only
+sees the integers.
+"""
+
+import heapq
+import os
+
+import key_ids
+import motion_codec
+
+
+def format_event(timestamp, event):
+  """Return the log line for an event."""
+  return format_fields(timestamp, event.type, event.code, event.value)
+
+
+def format_fields(timestamp, atype, code, value):
+  """Return the log line for an event given as its fields."""
+  return '%.5f;%s;%s;%s\n' % (timestamp, atype, key_ids.key_name(code), value)
+
+
+def format_window(window, wm_class, title):
+  """Return the line describing a window id."""
+  title = u' '.join(title.splitlines())
+  return (u'#window;%d;%s;%s\n' % (window, wm_class, title)).encode('utf-8')
+
+
+def format_source(source):
+  """Return the line naming the source of the events that follow."""
+  return '#source;%s\n' % source
+
+
+def parse_value(atype, text):
+  """Parse the value column, (x, y) for motion and an int otherwise."""
+  if atype == 'EV_MOV':
+    x, y = text.strip('()').split(',')
+    return int(x), int(y)
+  return int(text)
+
+
+def parse_line(line):
+  """Parse a log line.
+  Returns:
+    (timestamp, type, key id, value), or None if it is not an event.
+  """
+  fields = line.rstrip('\n').split(';')
+  if len(fields) != 4:
+    return None
+  try:
+    return (float(fields[0]), fields[1], key_ids.key_id(fields[2]),
+            parse_value(fields[1], fields[3]))
+  except ValueError:
+    return None
+
+
+def read_notes(fname):
+  """Read the notes README of a recordings directory.
+
+  The README has a "name:" line per recording followed by indented
+  "Key: value" lines, e.g. "\tUser: prvak".
+  Returns:
+    dict recording name -> dict of notes, keys lower cased.
+  """
+  notes = {}
+  current = None
+  for line in open(fname):
+    if not line.strip():
+      continue
+    if line[0].isspace():
+      if current is not None and ':' in line:
+        key, value = line.split(':', 1)
+        current[key.strip().lower()] = value.strip()
+    else:
+      current = notes.setdefault(line.strip().rstrip(':'), {})
+  return notes
+
+
+def read_windows(fin):
+  """Read the window descriptions of an open recording.
+  Returns:
+    dict window id -> (class, title)
+  """
+  windows = {0: (u'', u'')}
+  for line in fin:
+    if line.startswith('#window;'):
+      unused_tag, window, wm_class, title = line.rstrip('\n').split(';', 3)
+      windows[int(window)] = (wm_class.decode('utf-8'), title.decode('utf-8'))
+  return windows
+
+
+def read_events(fin):
+  """Yield the parsed events of an open recording."""
+  for line in fin:
+    event = parse_line(line)
+    if event:
+      yield event
+
+
+def motion_path(fname):
+  """The motion_codec file holding the motion of a recording."""
+  return fname + '.mov'
+
+
+def read_with_motion(fname):
+  """Yield the parsed events of a recording file in time order, with the
+  motion of its motion_path() file if it has one.
+
+  The motion file then replaces any motion in the text, which cli convert
+  leaves there.
+  """
+  if not os.path.exists(motion_path(fname)):
+    fin = open(fname)
+    try:
+      for event in read_events(fin):
+        yield event
+    finally:
+      fin.close()
+    return
+  fin = open(fname)
+  try:
+    keys = (event for event in read_events(fin) if event[1] != 'EV_MOV')
+    for event in heapq.merge(keys,
+                             motion_codec.read_events(motion_path(fname))):
+      yield event
+  finally:
+    fin.close()
+
+
+def read_recording(fname):
+  """Return the list of parsed events in a recording file, see
+  read_with_motion()."""
+  return list(read_with_motion(fname))
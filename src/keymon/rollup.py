@@ -0,0 +1,311 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-aggregated time buckets of recordings, for long range plots.
+
+A rollup keeps, per second, minute and hour, the number of events, key
+presses and pixels of mouse motion, plus per key press counts and dwell sums.
+It is saved as JSON next to the recording, in recording + '.rollup', together
+with how far into the recording it got, so updating it after the log grew
+only reads the new lines, and the new blocks of its recording.motion_path()
+file if it has one. The per second buckets, by far the most, go into
+recording + '.rollup.1' instead, a JSON row per line that updates append to.
+
+  python rollup.py recording...         # build or update the rollups
+"""
+
+import collections
+import json
+import math
+import os
+import sys
+
+import key_ids
+import motion_codec
+import recording
+
+# Bucket sizes in seconds, finest first.
+LEVELS = (1, 60, 3600)
+METRICS = ('events', 'presses', 'motion')
+_EVENTS, _PRESSES, _MOTION = range(len(METRICS))
+
+
+class Rollup(object):
+  """Time buckets and per key totals of one recording or a corpus."""
+
+  def __init__(self):
+    self.offset = 0  # bytes of the recording already counted
+    self.motion_offset = 0  # bytes of its motion file already counted
+    self.buckets = dict((level, {}) for level in LEVELS)
+    self.seconds_size = 0  # bytes of the seconds file holding the rest
+    self._added = {}  # per second counts added since the last save
+    self.presses = collections.Counter()
+    self.dwell_sum = collections.defaultdict(float)
+    self._down = {}  # key name -> press time
+    self._position = None
+
+  def add(self, timestamp, atype, code, value):
+    """Count one parsed event."""
+    motion = 0.0
+    presses = 0
+    if atype == 'EV_MOV':
+      if self._position is not None:
+        motion = math.hypot(value[0] - self._position[0],
+                            value[1] - self._position[1])
+      self._position = value
+    elif atype == 'EV_KEY':
+      name = key_ids.key_name(code)
+      if value == 1:
+        presses = 1
+        self.presses[name] += 1
+        self._down[name] = timestamp
+      elif value == 0 and name in self._down:
+        self.dwell_sum[name] += timestamp - self._down.pop(name)
+    for level in LEVELS:
+      bucket = int(timestamp // level) * level
+      counts = self.buckets[level].get(bucket)
+      if counts is None:
+        counts = self.buckets[level][bucket] = [0, 0, 0.0]
+      counts[_EVENTS] += 1
+      counts[_PRESSES] += presses
+      counts[_MOTION] += motion
+    bucket = int(timestamp // LEVELS[0]) * LEVELS[0]
+    added = self._added.setdefault(bucket, [0, 0, 0.0])
+    added[_EVENTS] += 1
+    added[_PRESSES] += presses
+    added[_MOTION] += motion
+
+  def update(self, fname):
+    """Count the complete lines added to a recording since the last update.
+    Returns:
+      number of events added
+    """
+    fin = open(fname, 'rb')
+    try:
+      if os.fstat(fin.fileno()).st_size < self.offset:
+        # A new file under the old name.
+        self.__init__()
+      fin.seek(self.offset)
+      data = fin.read()
+    finally:
+      fin.close()
+    end = data.rfind('\n') + 1
+    added = 0
+    motion = recording.motion_path(fname)
+    has_motion = os.path.exists(motion)
+    for line in data[:end].splitlines():
+      event = recording.parse_line(line)
+      if event and not (has_motion and event[1] == 'EV_MOV'):
+        self.add(*event)
+        added += 1
+    self.offset += end
+    if has_motion:
+      added += self._update_motion(motion)
+    return added
+
+  def _update_motion(self, path):
+    """Count the complete blocks added to a motion file."""
+    added = 0
+    fin = open(path, 'rb')
+    try:
+      fin.seek(self.motion_offset)
+      for data, blocks in motion_codec.read_blocks(fin):
+        self.motion_offset += len(data)
+        for timestamp, x, y in zip(*motion_codec.decode(data, blocks)):
+          self.add(float(timestamp), 'EV_MOV', key_ids.NO_KEY,
+                   (int(x), int(y)))
+          added += 1
+    finally:
+      fin.close()
+    return added
+
+  def merge(self, other):
+    """Add the counts of another rollup, e.g. to build a corpus rollup."""
+    for level in LEVELS:
+      _add_buckets(self.buckets[level], other.buckets[level])
+    _add_buckets(self._added, other.buckets[LEVELS[0]])
+    self.presses.update(other.presses)
+    for name, dwell in other.dwell_sum.items():
+      self.dwell_sum[name] += dwell
+    return self
+
+  def query(self, metric, start, end, step):
+    """Sum a metric over [start, end) in bins of step seconds.
+
+    Uses the coarsest level that divides both step and start, so a query
+    over months by the hour reads hour buckets, not seconds. A start inside
+    a second is taken from the start of that second.
+    Returns:
+      list of (bin start, value)
+    """
+    start = int(start // LEVELS[0]) * LEVELS[0]
+    level = max([level for level in LEVELS
+                 if step % level == 0 and start % level == 0] or LEVELS[:1])
+    idx = METRICS.index(metric)
+    bins = collections.OrderedDict(
+        (start + i * step, 0) for i in xrange(int(math.ceil(
+            float(end - start) / step))))
+    buckets = self.buckets[level]
+    if len(bins) * step / level < len(buckets):
+      keys = xrange(start, int(math.ceil(end)), level)
+    else:
+      keys = sorted(bucket for bucket in buckets if start <= bucket < end)
+    for bucket in keys:
+      counts = buckets.get(bucket)
+      if counts:
+        bins[start + (bucket - start) // step * step] += counts[idx]
+    return bins.items()
+
+  def to_json(self):
+    """The rollup but its per second buckets, which save() appends."""
+    return {
+        'offset': self.offset,
+        'motion_offset': self.motion_offset,
+        'seconds_size': self.seconds_size,
+        'buckets': dict((str(level), [[bucket] + counts for bucket, counts in
+                                      sorted(self.buckets[level].items())])
+                        for level in LEVELS[1:]),
+        'presses': self.presses,
+        'dwell_sum': self.dwell_sum,
+        'down': self._down,
+        'position': self._position,
+    }
+
+  @classmethod
+  def from_json(cls, data):
+    ret = cls()
+    ret.offset = data['offset']
+    ret.motion_offset = data.get('motion_offset', 0)
+    ret.seconds_size = data.get('seconds_size', 0)
+    for level in LEVELS:
+      ret.buckets[level] = dict((row[0], row[1:])
+                                for row in data['buckets'].get(str(level), ()))
+    # Rollups saved with their seconds inline move them to the seconds file.
+    _add_buckets(ret._added, ret.buckets[LEVELS[0]])
+    ret.presses.update(data['presses'])
+    ret.dwell_sum.update(data['dwell_sum'])
+    ret._down = data['down']
+    ret._position = data['position'] and tuple(data['position'])
+    return ret
+
+  def read_seconds(self, fin):
+    """Add the per second buckets of a seconds file, as far as saved."""
+    _add_buckets(self.buckets[LEVELS[0]],
+                 _read_rows(fin.read(self.seconds_size)))
+
+  def write_seconds(self, fout):
+    """Append the per second counts added since the last save."""
+    fout.truncate(self.seconds_size)  # rows of a save that didn't finish
+    fout.seek(self.seconds_size)
+    for bucket, counts in sorted(self._added.items()):
+      fout.write(json.dumps([bucket] + counts) + '\n')
+    fout.flush()
+    self.seconds_size = fout.tell()
+    self._added = {}
+
+
+def _add_buckets(total, buckets):
+  """Add a dict of bucket -> counts into another, or pairs of them."""
+  if isinstance(buckets, dict):
+    buckets = buckets.iteritems()
+  for bucket, counts in buckets:
+    mine = total.setdefault(bucket, [0, 0, 0.0])
+    for idx, count in enumerate(counts):
+      mine[idx] += count
+
+
+def _read_rows(data):
+  """Yield (bucket, counts) of the rows of a seconds file, a bucket may
+  come more than once."""
+  for line in data.splitlines():
+    row = json.loads(line)
+    yield row[0], row[1:]
+
+
+def rollup_path(fname):
+  """Where the rollup of a recording is kept."""
+  return fname + '.rollup'
+
+
+def seconds_path(fname):
+  """Where the per second buckets of a recording are kept."""
+  return '%s.%d' % (rollup_path(fname), LEVELS[0])
+
+
+def load(fname):
+  """Return the saved rollup of a recording, or an empty one."""
+  path = rollup_path(fname)
+  if not os.path.exists(path):
+    return Rollup()
+  fin = open(path)
+  try:
+    rollup = Rollup.from_json(json.load(fin))
+  finally:
+    fin.close()
+  if rollup.seconds_size:
+    fin = open(seconds_path(fname), 'rb')
+    try:
+      rollup.read_seconds(fin)
+    finally:
+      fin.close()
+  return rollup
+
+
+def save(fname, rollup):
+  """Save the rollup of a recording.
+
+  The new per second rows are appended first, then the rest is replaced
+  atomically. Rows past the seconds_size of the saved rollup are left by
+  a save that failed in between, and are dropped by the next.
+  """
+  path = seconds_path(fname)
+  fout = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+  try:
+    rollup.write_seconds(fout)
+  finally:
+    fout.close()
+  path = rollup_path(fname)
+  fout = open(path + '.tmp', 'w')
+  try:
+    json.dump(rollup.to_json(), fout)
+  finally:
+    fout.close()
+  os.rename(path + '.tmp', path)
+
+
+def update(fname):
+  """Bring the saved rollup of a recording up to date and return it."""
+  rollup = load(fname)
+  if rollup.update(fname):
+    save(fname, rollup)
+  return rollup
+
+
+def corpus(fnames):
+  """Update the rollups of several recordings and merge them."""
+  total = Rollup()
+  for fname in fnames:
+    total.merge(update(fname))
+  return total
+
+
+def main(argv):
+  for fname in argv[1:]:
+    rollup = update(fname)
+    print '%s: %d hours, %d key presses' % (
+        fname, len(rollup.buckets[3600]), sum(rollup.presses.values()))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Split recordings into sessions at idle gaps and analyze them in parallel.
+
+  python sessions.py [--idle=SECONDS] [--processes=N] recording...
+"""
+
+import multiprocessing
+import optparse
+import sys
+
+import numpy as np
+
+import event_array
+import key_ids
+import stats
+
+# Seconds without any event that end a session.
+DEFAULT_IDLE = 300.0
+
+
+def find_sessions(times, idle=DEFAULT_IDLE):
+  """Find the session boundaries of sorted timestamps.
+  Returns:
+    array of indices, session i is times[bounds[i]:bounds[i + 1]].
+  """
+  gaps = np.flatnonzero(np.diff(times) > idle) + 1
+  return np.concatenate(([0], gaps, [len(times)]))
+
+
+def split(arr, bounds):
+  """The sessions of an event_array, as views."""
+  return [arr[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _analyze(args):
+  func, arr, names = args
+  return func(arr, names)
+
+
+def analyze(parts, func=stats.compute, processes=None):
+  """Run func(part, key names) over parts of event_arrays.
+  Args:
+    parts: event_arrays, e.g. the sessions of one or more recordings.
+    func: module level function, so it can be sent to other processes.
+    processes: number of worker processes, default one per core, 1 runs
+        everything in this process.
+  Returns:
+    list of results, in the order of parts.
+  """
+  names = key_ids.key_names()
+  tasks = [(func, part, names) for part in parts]
+  if processes == 1 or len(tasks) < 2:
+    return map(_analyze, tasks)
+  pool = multiprocessing.Pool(processes)
+  try:
+    return pool.map(_analyze, tasks)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def merge(results):
+  """Merge stats.Stats results into one."""
+  total = stats.Stats()
+  for result in results:
+    total.merge(result)
+  return total
+
+
+def main(argv):
+  parser = optparse.OptionParser('Usage: %prog [Options...] recording...')
+  parser.add_option('--idle', type='float', default=DEFAULT_IDLE,
+                    help='Seconds without events that end a session.')
+  parser.add_option('--processes', type='int', default=None,
+                    help='Worker processes, default one per core.')
+  opts, fnames = parser.parse_args(argv[1:])
+  parts = []
+  for fname in fnames:
+    arr = event_array.load(fname)
+    parts.extend(split(arr, find_sessions(arr['time'], opts.idle)))
+  results = analyze(parts, processes=opts.processes)
+  for idx, result in enumerate(results):
+    print 'Session %d:' % (idx + 1)
+    print result.report(top=3)
+  print 'Total:'
+  print merge(results).report()
+
+
+if __name__ == '__main__':
+  main(sys.argv)
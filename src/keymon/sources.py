@@ -0,0 +1,230 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Event sources KeyMon can read from.
+
+xlib.XEvents captures from a live X server, the sources here need no X at
+all: ReplaySource plays back a recording and SyntheticSource makes up typing
+and mouse streams, which lets the rest of the pipeline be load tested.
+"""
+
+import collections
+import heapq
+import itertools
+import random
+import time
+
+import key_ids
+import recording
+from events import XEvent
+
+
+class EventSource(object):
+  """Interface of an event source.
+
+  KeyMon calls start() once, then polls next_event() until the source is
+  finished or the program quits, and calls stop_listening() on the way out.
+  Sources with a fileno() are not polled: KeyMon calls read_ready() when it
+  is readable and then takes the queued events.
+
+  With --track_windows KeyMon sets windows to its window_tracker, and
+  sources stamp each event with the window focused when they made it. With
+  --autorepeat it sets autorepeat to an autorepeat.AutoRepeatFilter, and
+  sources run their events through it before queueing them.
+  """
+
+  windows = None
+  autorepeat = None
+
+  def start(self):
+    """Start producing events."""
+    raise NotImplementedError
+
+  def next_event(self):
+    """Returns the next event in queue, or None if none."""
+    raise NotImplementedError
+
+  def stop_listening(self):
+    """Stop producing events."""
+    raise NotImplementedError
+
+  def listening(self):
+    """Are you listening?"""
+    raise NotImplementedError
+
+  def finished(self):
+    """True once the source has run out of events for good."""
+    return False
+
+  def read_mod_map(self):
+    """Read the keymap of the source, or None if it has none."""
+    return None
+
+  def queued(self):
+    """Number of events read but not taken by next_event() yet."""
+    return 0
+
+  def fileno(self):
+    """A descriptor that is readable when read_ready() has events to read,
+    or None if the source can only be polled."""
+    return None
+
+  def read_ready(self):
+    """Read what is waiting on fileno(), queuing its events."""
+    pass
+
+  def current_window(self):
+    """Id of the focused window to stamp events with, 0 if untracked."""
+    if self.windows is None:
+      return 0
+    return self.windows.current
+
+
+class _ScheduledSource(EventSource):
+  """Hands out (due, event) pairs once the clock reaches their due time.
+
+  Due times are seconds from start(), multiplied by time_scale. A time_scale
+  of 0 hands events out as fast as they are asked for.
+  """
+
+  def __init__(self, time_scale=1.0):
+    self.time_scale = time_scale
+    self._listening = False
+    self._start = None
+    self._next = None
+    self._ready = collections.deque()  # filtered events to hand out
+
+  def _events(self):
+    """Yield (due, event) pairs in due order."""
+    raise NotImplementedError
+
+  def start(self):
+    self._iter = self._events()
+    self._start = time.time()
+    self._listening = True
+    self._next = next(self._iter, None)
+
+  def next_event(self):
+    if self._ready:
+      return self._ready.popleft()
+    if not self._listening or self._next is None:
+      self._listening = False
+      return None
+    due, event = self._next
+    if self.time_scale and time.time() - self._start < due * self.time_scale:
+      return None
+    self._next = next(self._iter, None)
+    event.window = self.current_window()
+    if self.autorepeat is None:
+      return event
+    self._ready.extend(self.autorepeat.filter(event))
+    if self._ready:
+      return self._ready.popleft()
+    return None
+
+  def stop_listening(self):
+    self._listening = False
+
+  def listening(self):
+    return self._listening
+
+  def finished(self):
+    return self._start is not None and self._next is None and not self._ready
+
+
+class ReplaySource(_ScheduledSource):
+  """Replays a recording.
+
+  A time_scale of 1 keeps the original inter-event timing, 0.5 plays twice as
+  fast and 0 drops the delays altogether. Events keep their recorded
+  timestamps, so a replay logs the times of the original.
+  """
+
+  def __init__(self, fname, time_scale=1.0):
+    _ScheduledSource.__init__(self, time_scale)
+    self.fname = fname
+
+  def _events(self):
+    first = None
+    for timestamp, atype, code, value in recording.read_with_motion(
+        self.fname):
+      if first is None:
+        first = timestamp
+      yield timestamp - first, XEvent(atype, 0, code, value, time=timestamp)
+
+
+class SyntheticSource(_ScheduledSource):
+  """Generates typing and mouse motion.
+
+  Key strokes and motion events arrive at the given mean rates per second.
+  Gaps are gamma distributed with a coefficient of variation of burstiness:
+  1 is a Poisson stream, larger values bunch events into bursts separated by
+  longer pauses, and 0 spaces them evenly.
+  """
+
+  KEYS = ['KEY_%s' % c for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'] + [
+      'KEY_SPACE', 'KEY_BACKSPACE', 'KEY_RETURN', 'KEY_SHIFT_L']
+
+  def __init__(self, key_rate=10.0, motion_rate=50.0, burstiness=1.0,
+               count=None, seed=None, time_scale=1.0):
+    _ScheduledSource.__init__(self, time_scale)
+    self.key_rate = key_rate
+    self.motion_rate = motion_rate
+    self.burstiness = burstiness
+    self.count = count
+    self._random = random.Random(seed)
+    self._keys = [key_ids.key_id(name) for name in self.KEYS]
+
+  def _gap(self, rate):
+    """Time to the next event of a stream with the given mean rate."""
+    if not self.burstiness:
+      return 1.0 / rate
+    shape = 1.0 / (self.burstiness ** 2)
+    return self._random.gammavariate(shape, 1.0 / (rate * shape))
+
+  def _events(self):
+    # Keys and motion come in due order by themselves, only the releases,
+    # due a random time after their press, need a heap.
+    never = float('inf')
+    next_key = next_motion = never
+    if self.key_rate > 0:
+      next_key = self._gap(self.key_rate)
+    if self.motion_rate > 0:
+      next_motion = self._gap(self.motion_rate)
+    releases = []  # heap of (due, seq, release XEvent)
+    seq = itertools.count()
+    rand = self._random.random
+    keys = self._keys
+    x, y = 500, 500
+    emitted = 0
+    while self.count is None or emitted < self.count:
+      next_release = releases[0][0] if releases else never
+      if next_key <= next_motion and next_key <= next_release:
+        if next_key == never:
+          return
+        due = next_key
+        code = keys[int(rand() * len(keys))]
+        yield due, XEvent('EV_KEY', 0, code, 1)
+        heapq.heappush(releases, (due + 0.03 + rand() * 0.12, next(seq),
+                                  XEvent('EV_KEY', 0, code, 0)))
+        next_key = due + self._gap(self.key_rate)
+      elif next_motion <= next_release:
+        due = next_motion
+        x = max(0, x + int(rand() * 17) - 8)
+        y = max(0, y + int(rand() * 17) - 8)
+        yield due, XEvent('EV_MOV', 0, key_ids.NO_KEY, (x, y))
+        next_motion = due + self._gap(self.motion_rate)
+      else:
+        yield heapq.heappop(releases)[0::2]
+      emitted += 1
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Summary statistics of recordings.
+
+compute() summarizes an event_array, and Stats from different parts of a
+recording, or different recordings, merge into one.
+"""
+
+import collections
+
+import numpy as np
+
+import event_array
+
+
+class Stats(object):
+  """Mergeable summary of some events. Keys are counted by name."""
+
+  def __init__(self):
+    self.events = 0
+    self.sessions = 0
+    self.start = None
+    self.end = None
+    self.active = 0.0  # seconds between the first and last events
+    self.presses = collections.Counter()
+    self.dwell_sum = 0.0
+    self.dwell_count = 0
+    self.motion_distance = 0.0
+    self.wheel = 0
+
+  def merge(self, other):
+    """Add the counts of other to this one."""
+    self.events += other.events
+    self.sessions += other.sessions
+    if other.start is not None:
+      if self.start is None:
+        self.start, self.end = other.start, other.end
+      else:
+        self.start = min(self.start, other.start)
+        self.end = max(self.end, other.end)
+    self.active += other.active
+    self.presses.update(other.presses)
+    self.dwell_sum += other.dwell_sum
+    self.dwell_count += other.dwell_count
+    self.motion_distance += other.motion_distance
+    self.wheel += other.wheel
+    return self
+
+  def report(self, top=10):
+    """Return a printable summary."""
+    lines = ['events: %d in %d session(s), %.1fs active' % (
+        self.events, self.sessions, self.active)]
+    key_presses = sum(self.presses.values())
+    if self.active:
+      lines.append('key presses: %d, %.1f/min' % (
+          key_presses, key_presses * 60.0 / self.active))
+    if self.dwell_count:
+      lines.append('mean dwell: %.1fms' % (
+          self.dwell_sum * 1000 / self.dwell_count))
+    lines.append('motion distance: %.0fpx, wheel clicks: %d' % (
+        self.motion_distance, self.wheel))
+    for name, count in self.presses.most_common(top):
+      lines.append('  %-20s %d' % (name, count))
+    return '\n'.join(lines)
+
+
+def dwell_times(keys):
+  """Press to release times of the key events in keys, in order of key."""
+  keys = keys[np.lexsort((keys['time'], keys['code']))]
+  pairs = ((keys['code'][1:] == keys['code'][:-1]) &
+           (keys['value'][:-1] == 1) & (keys['value'][1:] == 0))
+  return (keys['time'][1:] - keys['time'][:-1])[pairs]
+
+
+def compute(arr, names):
+  """Summarize an event_array.
+  Args:
+    arr: the events, taken as one session.
+    names: key_ids.key_names() of the process that built arr.
+  """
+  ret = Stats()
+  ret.events = len(arr)
+  if not len(arr):
+    return ret
+  ret.sessions = 1
+  ret.start = float(arr['time'][0])
+  ret.end = float(arr['time'][-1])
+  ret.active = ret.end - ret.start
+
+  keys = arr[arr['type'] == event_array.EV_KEY]
+  pressed = keys['code'][keys['value'] == 1]
+  counts = np.bincount(pressed, minlength=len(names))
+  for code in np.flatnonzero(counts):
+    ret.presses[names[code]] = int(counts[code])
+  dwell = dwell_times(keys)
+  ret.dwell_sum = float(dwell.sum())
+  ret.dwell_count = len(dwell)
+
+  motion = arr[arr['type'] == event_array.EV_MOV]
+  if len(motion) > 1:
+    ret.motion_distance = float(np.hypot(np.diff(motion['value']),
+                                         np.diff(motion['y'])).sum())
+  ret.wheel = int((arr['type'] == event_array.EV_REL).sum())
+  return ret
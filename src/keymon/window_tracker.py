@@ -0,0 +1,132 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Track which window has the focus.
+
+Rather than asking for _NET_ACTIVE_WINDOW on every event, a thread listens for
+PropertyNotify on the root window (and on the focused window, for title
+changes) and keeps the id of the current (class, title) pair in current.
+Reading it is all the per-event work there is.
+"""
+
+import threading
+
+from Xlib import X
+from Xlib import Xatom
+from Xlib import display
+from Xlib import error
+
+# Most (class, title) pairs given an id. A title changing all the time, like
+# a terminal's or a clock's, would grow the table without end; past the cap
+# new titles get the id of their class with an empty title.
+MAX_WINDOWS = 4096
+
+
+class WindowTracker(threading.Thread):
+  """A thread keeping current, the id of the focused window's class/title.
+
+  windows is the table of (class, title) pairs indexed by id; it only grows,
+  up to MAX_WINDOWS titled entries plus an untitled one per class, and id 0
+  is for when the focused window is unknown.
+  """
+
+  def __init__(self, max_windows=MAX_WINDOWS):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.setName('Window-thread')
+    self.disp = display.Display()
+    self.root = self.disp.screen().root
+    self._active_atom = self.disp.intern_atom('_NET_ACTIVE_WINDOW')
+    self._name_atom = self.disp.intern_atom('_NET_WM_NAME')
+    self._utf8_atom = self.disp.intern_atom('UTF8_STRING')
+    self.windows = [(u'', u'')]
+    self._ids = {self.windows[0]: 0}
+    self._max_windows = max_windows
+    self.current = 0
+    self._window = None
+    self._running = False
+    self.root.change_attributes(event_mask=X.PropertyChangeMask)
+    self._update()
+
+  def run(self):
+    """Standard run method for threading."""
+    self._running = True
+    while self._running:
+      event = self.disp.next_event()
+      if event.type != X.PropertyNotify:
+        continue
+      if event.atom in (self._active_atom, self._name_atom, Xatom.WM_NAME):
+        self._update()
+
+  def stop(self):
+    """Stop tracking after the next X event."""
+    self._running = False
+
+  def _active_window(self):
+    """The focused window, or None."""
+    prop = self.root.get_full_property(self._active_atom, X.AnyPropertyType)
+    if not prop or not prop.value or not prop.value[0]:
+      return None
+    return self.disp.create_resource_object('window', prop.value[0])
+
+  def _describe(self, window):
+    """Return (class, title) of a window."""
+    wm_class = window.get_wm_class()
+    if wm_class:
+      wm_class = wm_class[1]
+    prop = window.get_full_property(self._name_atom, self._utf8_atom)
+    if prop:
+      title = prop.value.decode('utf-8', 'replace')
+    else:
+      title = window.get_wm_name() or u''
+      if isinstance(title, str):
+        title = title.decode('latin-1')
+    return wm_class or u'', title
+
+  def _update(self):
+    """Look the focused window up again after a property changed."""
+    try:
+      window = self._active_window()
+      if window != self._window:
+        self._watch(window)
+      if window is None:
+        self.current = 0
+        return
+      key = self._describe(window)
+    except error.XError:
+      self.current = 0
+      return
+    self.current = self._intern(key)
+
+  def _intern(self, key):
+    """The id of a (class, title) pair, a new one if there is room."""
+    if key not in self._ids:
+      if len(self.windows) >= self._max_windows:
+        key = (key[0], u'')
+        if key in self._ids:
+          return self._ids[key]
+      self._ids[key] = len(self.windows)
+      self.windows.append(key)
+    return self._ids[key]
+
+  def _watch(self, window):
+    """Listen for title changes of window instead of the previous one."""
+    if self._window is not None:
+      try:
+        self._window.change_attributes(event_mask=X.NoEventMask)
+      except error.XError:
+        pass
+    self._window = window
+    if window is not None:
+      window.change_attributes(event_mask=X.PropertyChangeMask)
@@ -28,65 +28,61 @@ from Xlib import XK
 from Xlib.ext import record
 from Xlib.protocol import rq
 import locale
+import re
 import sys
 import time
 import threading
 import collections
 
-class XEvent(object):
-  """An event, mimics edev.py events."""
-  def __init__(self, atype, scancode, code, value):
-    self._type = atype
-    self._scancode = scancode
-    self._code = code
-    self._value = value
-
-  def get_type(self):
-    """Get the type of event."""
-    return self._type
-  type = property(get_type)
-
-  def get_scancode(self):
-    """Get the scancode if any."""
-    return self._scancode
-  scancode = property(get_scancode)
-
-  def get_code(self):
-    """Get the code string."""
-    return self._code
-  code = property(get_code)
-
-  def get_value(self):
-    """Get the value 0 for up, 1 for down, etc."""
-    return self._value
-  value = property(get_value)
-
-  def __str__(self):
-    return 'type:%s scancode:%s code:%s value:%s' % (self._type, 
-        self._scancode, self._code, self._value)
-
-class XEvents(threading.Thread):
-  """A thread to queue up X window events from RECORD extension."""
+import key_ids
+import mod_mapper
+import sources
+from events import XEvent
+
+# Keysym groups the keymap may reasonably use, see Xlib/keysymdef.
+_KEYSYM_GROUPS = ('latin1', 'latin2', 'latin3', 'latin4', 'greek',
+                  'cyrillic', 'miscellany', 'xkb', 'xf86')
+
+# Later aliases of keysyms, XKeysymToString() gives the first name instead.
+_KEYSYM_ALIASES = re.compile(
+    r'^(Page_Up|Page_Down|KP_Page_Up|KP_Page_Down|script_switch|quoteright|'
+    r'quoteleft|Eth|Thorn|kappa|Zen_Koho|Mae_Koho|Henkan|Greek_switch|'
+    r'ISO_Group_Shift|[LR]\d+)$')
+
+
+def keysym_names():
+  """Return a dict keysym -> name, using the names xmodmap prints."""
+  names = {}
+  for group in _KEYSYM_GROUPS:
+    XK.load_keysym_group(group)
+  for name in sorted(dir(XK)):
+    if name[:3] != 'XK_' or _KEYSYM_ALIASES.match(name[3:]):
+      continue
+    keysym = getattr(XK, name)
+    if keysym not in names:
+      names[keysym] = name[3:].replace('XF86_', 'XF86')
+  return names
+
+
+class _RecordEvents(sources.EventSource):
+  """Decodes X events from RECORD replies into a queue of XEvents."""
 
   _butn_to_code = {
       1: 'BTN_LEFT', 2: 'BTN_MIDDLE', 3: 'BTN_RIGHT',
       4: 'REL_WHEEL', 5: 'REL_WHEEL', 6: 'REL_LEFT', 7: 'REL_RIGHT'}
+  _butn_to_id = dict((butn, key_ids.key_id(name))
+                     for butn, name in _butn_to_code.items())
 
   def __init__(self):
-    threading.Thread.__init__(self)
-    self.setDaemon(True)
-    self.setName('Xlib-thread')
     self._listening = False
     self.record_display = display.Display()
     self.local_display = display.Display()
     self.ctx = None
-    self.keycode_to_symbol = collections.defaultdict(lambda: 'KEY_DUNNO')
+    self.keycode_to_symbol = {}
     self._setup_lookup()
-    self.events = []  # each of type XEvent
-
-  def run(self):
-    """Standard run method for threading."""
-    self.start_listening()
+    self._keycode_to_id = self._keycode_ids()
+    self.events = collections.deque()  # each of type XEvent
+    self._filter_lock = threading.Lock()  # autorepeat is shared by threads
 
   def _setup_lookup(self):
     """Setup the key lookups."""
@@ -119,18 +115,67 @@ class XEvents(threading.Thread):
     self.keycode_to_symbol[442] = 'KEY_SCEDILLA' # scancode = 39 / 40
 
 
+  def _keycode_ids(self):
+    """Array of key ids indexed by X keycode, for the unshifted keysyms."""
+    ids = [key_ids.key_id('KEY_DUNNO')] * 256
+    for keycode in range(8, 256):
+      keysym = self.local_display.keycode_to_keysym(keycode, 0)
+      if not keysym:
+        continue
+      if keysym not in self.keycode_to_symbol:
+        print 'Missing code for %d = %d' % (keycode - 8, keysym)
+      ids[keycode] = key_ids.key_id(
+          self.keycode_to_symbol.get(keysym, 'KEY_DUNNO'))
+    return ids
+
+  def read_mod_map(self):
+    """Read the server keymap with a single GetKeyboardMapping request.
+    Returns:
+      a ModMapper like mod_mapper.parse_modmap() builds from xmodmap -pk.
+    """
+    min_keycode = self.local_display.display.info.min_keycode
+    max_keycode = self.local_display.display.info.max_keycode
+    keysyms = self.local_display.get_keyboard_mapping(
+        min_keycode, max_keycode - min_keycode + 1)
+    return mod_mapper.mod_map_from_keysyms(min_keycode, keysyms,
+                                           keysym_names())
+
   def next_event(self):
     """Returns the next event in queue, or None if none."""
     if self.events:
-      return self.events.pop(0)
+      return self.events.popleft()
+    if self.autorepeat is not None and self.autorepeat.held():
+      self._filter_lock.acquire()
+      try:
+        self.events.extend(self.autorepeat.flush(time.time()))
+      finally:
+        self._filter_lock.release()
+      if self.events:
+        return self.events.popleft()
     return None
 
-  def start_listening(self):
-    """Start listening to RECORD extension and queuing events."""
+  def _queue(self, event, server_time=None):
+    """Queue an event, through the autorepeat filter if there is one.
+    Args:
+      server_time: the X server time of a key event, in milliseconds.
+    """
+    if self.autorepeat is None:
+      self.events.append(event)
+      return
+    self._filter_lock.acquire()
+    try:
+      self.events.extend(self.autorepeat.filter(event, server_time))
+    finally:
+      self._filter_lock.release()
+
+  def queued(self):
+    return len(self.events)
+
+  def _create_context(self):
+    """Create the RECORD context of the device events."""
     if not self.record_display.has_extension("RECORD"):
       print "RECORD extension not found"
       sys.exit(1)
-    self._listening = True
     self.ctx = self.record_display.record_create_context(
         0,
         [record.AllClients],
@@ -146,22 +191,6 @@ class XEvents(threading.Thread):
             'client_died': False,
         }])
 
-    self.record_display.record_enable_context(self.ctx, self._handler)
-
-    # Don't understand this, how can we free the context yet still use it in Stop?
-    self.record_display.record_free_context(self.ctx)
-    self.record_display.close()
-
-  def stop_listening(self):
-    """Stop listening to events."""
-    if not self._listening:
-      return
-    self.local_display.record_disable_context(self.ctx)
-    self.local_display.flush()
-    self.local_display.close()
-    self._listening = False
-    self.join(0.05)
-
   def listening(self):
     """Are you listening?"""
     return self._listening
@@ -173,52 +202,142 @@ class XEvents(threading.Thread):
     if reply.client_swapped:
       return
     data = reply.data
+    # Stamped here, not when KeyMon gets to them, so a backlog keeps the
+    # times and windows of its events.
+    now = time.time()
+    window = self.current_window()
     while len(data):
       event, data = rq.EventField(None).parse_binary_value(
           data, self.record_display.display, None, None)
       if event.type == X.ButtonPress:
-        self._handle_mouse(event, 1)
+        self._handle_mouse(event, 1, now, window)
       elif event.type == X.ButtonRelease:
-        self._handle_mouse(event, 0)
+        self._handle_mouse(event, 0, now, window)
       elif event.type == X.KeyPress:
-        self._handle_key(event, 1)
+        self._handle_key(event, 1, now, window)
       elif event.type == X.KeyRelease:
-        self._handle_key(event, 0)
+        self._handle_key(event, 0, now, window)
       elif event.type == X.MotionNotify:
-        self._handle_mouse(event, 2)
+        self._handle_mouse(event, 2, now, window)
       else:
         print event
 
-  def _handle_mouse(self, event, value):
+  def _handle_mouse(self, event, value, now, window):
     """Add a mouse event to events.
     Params:
       event: the event info
       value: 2=motion, 1=down, 0=up
+      now: the capture time
+      window: the focused window id
     """
     if value == 2:
-      self.events.append(XEvent('EV_MOV',
-          0, 0, (event.root_x, event.root_y)))
+      self._queue(XEvent('EV_MOV',
+          0, 0, (event.root_x, event.root_y), window, now))
     elif event.detail in [4, 5]:
       if event.detail == 5:
         value = -1
       else:
         value = 1
-      self.events.append(XEvent('EV_REL',
-          0, XEvents._butn_to_code.get(event.detail, 'BTN_%d' % event.detail), value))
+      self._queue(XEvent('EV_REL', 0, self._button_id(event.detail),
+                         value, window, now))
     else:
-      self.events.append(XEvent('EV_KEY',
-          0, XEvents._butn_to_code.get(event.detail, 'BTN_%d' % event.detail), value))
+      self._queue(XEvent('EV_KEY', 0, self._button_id(event.detail),
+                         value, window, now))
 
-  def _handle_key(self, event, value):
+  def _button_id(self, detail):
+    """Key id of a mouse button."""
+    key = XEvents._butn_to_id.get(detail)
+    if key is None:
+      key = key_ids.key_id('BTN_%d' % detail)
+    return key
+
+  def _handle_key(self, event, value, now, window):
     """Add key event to events.
     Params:
       event: the event info
       value: 1=down, 0=up
+      now: the capture time
+      window: the focused window id
     """
-    keysym = self.local_display.keycode_to_keysym(event.detail, 0)
-    if keysym not in self.keycode_to_symbol:
-      print 'Missing code for %d = %d' % (event.detail - 8, keysym)
-    self.events.append(XEvent('EV_KEY', event.detail - 8, self.keycode_to_symbol[keysym], value))
+    self._queue(XEvent('EV_KEY', event.detail - 8,
+                       self._keycode_to_id[event.detail], value, window, now),
+                event.time)
+
+
+class XEvents(threading.Thread, _RecordEvents):
+  """A thread to queue up X window events from RECORD extension."""
+
+  def __init__(self):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.setName('Xlib-thread')
+    _RecordEvents.__init__(self)
+
+  def run(self):
+    """Standard run method for threading."""
+    self.start_listening()
+
+  def start_listening(self):
+    """Start listening to RECORD extension and queuing events."""
+    self._create_context()
+    self._listening = True
+    self.record_display.record_enable_context(self.ctx, self._handler)
+
+    # Don't understand this, how can we free the context yet still use it in Stop?
+    self.record_display.record_free_context(self.ctx)
+    self.record_display.close()
+
+  def stop_listening(self):
+    """Stop listening to events."""
+    if not self._listening:
+      return
+    self.local_display.record_disable_context(self.ctx)
+    self.local_display.flush()
+    self.local_display.close()
+    self._listening = False
+    self.join(0.05)
+
+
+class XEventsAsync(_RecordEvents):
+  """RECORD events without a thread, read when the connection is readable.
+
+  start() only sends the EnableContext request. The caller watches fileno()
+  in its own main loop and calls read_ready() when it is readable, which
+  parses the replies waiting on the socket and queues their events, so the
+  events are handled by the same thread that logs them, as soon as they
+  arrive.
+  """
+
+  def start(self):
+    self._create_context()
+    record.EnableContext(
+        callback=self._handler,
+        display=self.record_display.display,
+        opcode=self.record_display.display.get_extension_major(
+            record.extname),
+        context=self.ctx,
+        defer=True)
+    self.record_display.flush()
+    self._listening = True
+
+  def fileno(self):
+    return self.record_display.fileno()
+
+  def read_ready(self):
+    """Parse the RECORD replies waiting on the connection."""
+    if self._listening:
+      self.record_display.pending_events()
+
+  def stop_listening(self):
+    """Stop listening to events."""
+    if not self._listening:
+      return
+    self._listening = False
+    self.local_display.record_disable_context(self.ctx)
+    self.local_display.flush()
+    self.local_display.close()
+    self.record_display.close()
+
 
 def _run_test():
   """Run a test or debug session."""
@@ -237,7 +356,7 @@ def _run_test():
         events.stop_listening()
       if evt:
         print evt
-        if evt.code == 'KEY_ESCAPE':
+        if evt.code == key_ids.find_id('KEY_ESCAPE'):
           events.stop_listening()
   finally:
     events.stop_listening()